@@ -0,0 +1,188 @@
+"""Arquivamento dos meses fechados em documentos compactos.
+
+Um mês encerrado e com todas as despesas pagas não muda mais, mas cada
+lançamento dele custava uma leitura a cada carga completa. A compactação junta
+os lançamentos de cada usuário e mês fechado num único documento da coleção
+"transaction_archives", em colunas (uma lista por campo), e apaga os documentos
+individuais. Uma carga passa a ler um documento por usuário e mês arquivado,
+mais os lançamentos dos meses ainda abertos.
+
+Editar ou excluir um lançamento arquivado desarquiva o mês antes da escrita; a
+próxima compactação o arquiva de novo se ele continuar fechado.
+
+Uso (por cron, depois da virada do mês):
+    python archives.py --credentials conta.json [--dry-run]
+"""
+import argparse
+import datetime
+import threading
+from collections import defaultdict
+
+from firebase_admin import firestore
+from google.api_core import exceptions as google_exceptions
+
+from firestore_access import sort_value
+
+ARCHIVE_COLLECTION = "transaction_archives"
+ARCHIVED_COLLECTION = "transactions"
+MAX_ROWS_PER_ARCHIVE = 2000  # Mantém o documento bem abaixo do limite de 1 MiB do Firestore
+_BATCH_SIZE = 400  # O Firestore aceita até 500 operações por lote
+
+
+def _doc_id(*parts):
+    return "|".join(str(part).replace("/", "-") for part in parts)
+
+
+def pack_rows(rows):
+    # rows: [(doc_id, dict)] -> {"ids": [...], "columns": {campo: [valor por linha]}}
+    fields = sorted({field for _, data in rows for field in data})
+    return {"ids": [doc_id for doc_id, _ in rows],
+            "columns": {field: [data.get(field) for _, data in rows] for field in fields}}
+
+
+def unpack_rows(archive):
+    columns = archive.get("columns") or {}
+    rows = []
+    for i, doc_id in enumerate(archive.get("ids") or []):
+        # Campos ausentes no documento original foram guardados como None
+        rows.append((doc_id, {field: values[i] for field, values in columns.items() if values[i] is not None}))
+    return rows
+
+
+def merge_rows(hot_rows, archived_rows):
+    # Se um desarquivamento parou no meio, o documento individual prevalece sobre a cópia arquivada
+    hot_ids = {doc_id for doc_id, _ in hot_rows}
+    rows = list(hot_rows) + [row for row in archived_rows if row[0] not in hot_ids]
+    rows.sort(key=lambda row: sort_value(row[1]["date"]), reverse=True)  # Mesma ordem da consulta por data decrescente
+    return rows
+
+
+def is_month_closed(rows, month_year, current_month):
+    if month_year >= current_month: return False
+    return all(data.get("status_pagamento", "Pendente") == "Pago" for _, data in rows if data.get("type") == "Despesa")
+
+
+class MonthArchiver:
+    def __init__(self, db, gateway):
+        self.db = db
+        self.gateway = gateway
+        self._lock = threading.RLock()
+        self._archive_of = {}  # id do lançamento -> id do arquivo que o contém
+
+    # --- Leitura ---
+    def load(self, max_age=None):
+        result = self.gateway.stream(ARCHIVE_COLLECTION, max_age=max_age)
+        archive_of, rows = {}, []
+        for archive_id, archive in result.rows:
+            for doc_id, data in unpack_rows(archive):
+                archive_of[doc_id] = archive_id
+                rows.append((doc_id, data))
+        with self._lock: self._archive_of = archive_of
+        return result._replace(rows=rows)
+
+    def is_archived(self, doc_id):
+        with self._lock: return doc_id in self._archive_of
+
+    # --- Desarquivamento ---
+    def unpack(self, archive_id):
+        # Lê o arquivo direto do banco: a cópia em cache pode ser anterior a uma recompactação
+        archive = self.gateway.get(ARCHIVE_COLLECTION, archive_id)
+        rows = unpack_rows(archive) if archive else []
+        for start in range(0, len(rows), _BATCH_SIZE):
+            batch = self.db.batch()
+            for doc_id, data in rows[start:start + _BATCH_SIZE]:
+                batch.set(self.db.collection(ARCHIVED_COLLECTION).document(doc_id), data)
+            self.gateway.run_write(batch.commit)
+        # O arquivo só é apagado depois que todos os documentos voltaram
+        if archive: self.gateway.run_write(lambda: self.db.collection(ARCHIVE_COLLECTION).document(archive_id).delete())
+        # Respostas em cache reaproveitadas depois disto já trazem os documentos individuais no lugar do arquivo
+        self.gateway.record_writes(ARCHIVED_COLLECTION, dict(rows), replace=True)
+        self.gateway.record_write(ARCHIVE_COLLECTION, archive_id)
+        with self._lock:
+            for doc_id in [doc_id for doc_id, owner in self._archive_of.items() if owner == archive_id]:
+                del self._archive_of[doc_id]
+        return len(rows)
+
+    def ensure_unpacked(self, doc_id):
+        with self._lock:
+            archive_id = self._archive_of.get(doc_id)
+            if archive_id is None: return False
+            self.unpack(archive_id)
+        return True
+
+    def guarded_write(self, doc_id, write):
+        # Toda escrita em um lançamento passa por aqui: se o mês estiver arquivado, ele é desarquivado antes
+        self.ensure_unpacked(doc_id)
+        try:
+            return write()
+        except google_exceptions.NotFound:
+            # O mês pode ter sido compactado depois da última leitura
+            self.load()
+            if not self.ensure_unpacked(doc_id): raise
+            return write()
+
+    def guarded_delete(self, doc_id):
+        # Excluir um documento inexistente não dá erro no Firestore, e um mês compactado depois da última leitura não
+        # seria desarquivado. Com a pré-condição exists=True a exclusão falha com NotFound e cai no desarquivamento
+        doc_ref = self.db.collection(ARCHIVED_COLLECTION).document(doc_id)
+        try:
+            self.guarded_write(doc_id, lambda: doc_ref.delete(option=self.db.write_option(exists=True)))
+        except google_exceptions.NotFound:
+            pass  # Não está em nenhum arquivo: já tinha sido excluído
+
+    # --- Compactação ---
+    def compact(self, hot_rows, current_month=None, dry_run=False):
+        # hot_rows: [(doc_id, dict)] com os documentos individuais de "transactions"
+        current_month = current_month or datetime.date.today().strftime("%Y-%m")
+        groups = defaultdict(lambda: ([], []))
+        hot_ids = set()
+        for doc_id, data in hot_rows:
+            if data.get("user") and data.get("month_year"):
+                groups[(data["user"], data["month_year"])][0].append((doc_id, data))
+                hot_ids.add(doc_id)
+        for doc_id, data in self.load().rows:
+            if doc_id not in hot_ids: groups[(data["user"], data["month_year"])][1].append((doc_id, data))
+        compacted = []
+        for (user, month_year), (hot, archived) in sorted(groups.items()):
+            rows = archived + hot
+            if not hot or len(rows) > MAX_ROWS_PER_ARCHIVE or not is_month_closed(rows, month_year, current_month): continue
+            compacted.append({"user": user, "month_year": month_year, "archived": len(hot), "total": len(rows)})
+            if not dry_run: self._write_archive(user, month_year, rows, [doc_id for doc_id, _ in hot])
+        return compacted
+
+    def _write_archive(self, user, month_year, rows, hot_ids):
+        rows = sorted(rows, key=lambda row: sort_value(row[1]["date"]))
+        archive = {"user": user, "month_year": month_year, "count": len(rows), "archived_at": firestore.SERVER_TIMESTAMP, **pack_rows(rows)}
+        # Grava o arquivo antes de apagar os documentos: uma interrupção no meio só deixa cópias duplicadas
+        self.gateway.run_write(lambda: self.db.collection(ARCHIVE_COLLECTION).document(_doc_id(user, month_year)).set(archive))
+        for start in range(0, len(hot_ids), _BATCH_SIZE):
+            batch = self.db.batch()
+            for doc_id in hot_ids[start:start + _BATCH_SIZE]:
+                batch.delete(self.db.collection(ARCHIVED_COLLECTION).document(doc_id))
+            self.gateway.run_write(batch.commit)
+
+
+def main(argv=None):
+    # Importado aqui: finance_data depende deste módulo
+    from finance_data import connect_firestore
+    from firestore_access import FirestoreGateway
+
+    parser = argparse.ArgumentParser(description="Compacta os meses fechados e pagos em um documento por usuário e mês.")
+    parser.add_argument("--credentials", help="Arquivo JSON da conta de serviço (padrão: variável FIREBASE_SERVICE_ACCOUNT_JSON)")
+    parser.add_argument("--before", help="Só compacta meses anteriores a este, no formato AAAA-MM (padrão: mês corrente)")
+    parser.add_argument("--dry-run", action="store_true", help="Só lista o que seria compactado")
+    args = parser.parse_args(argv)
+
+    db = connect_firestore(args.credentials)
+    gateway = FirestoreGateway(db, daily_read_budget=None)
+    archiver = MonthArchiver(db, gateway)
+    hot_rows = gateway.stream(ARCHIVED_COLLECTION).rows
+    compacted = archiver.compact(hot_rows, args.before, args.dry_run)
+    for item in compacted:
+        print(f"{item['month_year']} {item['user']}: {item['archived']} documento(s) -> 1 arquivo com {item['total']} lançamento(s)")
+    archived_docs = sum(item["archived"] for item in compacted)
+    print(f"{'Seriam compactados' if args.dry_run else 'Compactados'} {archived_docs} documento(s) em {len(compacted)} arquivo(s).")
+
+
+if __name__ == "__main__":
+    main()
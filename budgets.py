@@ -0,0 +1,197 @@
+"""Orçamentos mensais por categoria com alertas avaliados na escrita.
+
+Cada lançamento gravado, editado ou excluído ajusta um total corrente por
+(usuário, tipo, categoria, mês), guardado na coleção "budget_totals" com
+incrementos atômicos. Limites, totais e o nível de alerta de cada categoria
+ficam em memória, então as páginas de resumo mostram os alertas sem consultar
+o banco nem reagregar o histórico. O total em memória muda na hora; os
+incrementos são enviados ao banco por uma thread em segundo plano.
+"""
+import threading
+
+from firebase_admin import firestore
+
+BUDGET_TYPES = ["Despesa", "Investimento"]
+WARNING_RATIO = 0.8  # A partir de 80% do limite o alerta fica em "atenção"
+LEVEL_WARNING = "atenção"
+LEVEL_EXCEEDED = "excedido"
+_BATCH_SIZE = 400  # O Firestore aceita até 500 operações por lote
+SEND_INTERVAL = 0.5  # Segundos entre os envios dos incrementos acumulados
+
+
+def normalize_category(category):
+    return (category or "").strip().capitalize()
+
+
+def _doc_id(*parts):
+    return "|".join(str(part).replace("/", "-") for part in parts)
+
+
+def alert_level(total, limit):
+    if not limit or limit <= 0: return None
+    if total > limit: return LEVEL_EXCEEDED
+    if total >= WARNING_RATIO * limit: return LEVEL_WARNING
+    return None
+
+
+def _month_of(data):
+    month_year = data.get("month_year")
+    if month_year: return month_year
+    date_value = data.get("date")
+    return date_value.strftime("%Y-%m") if hasattr(date_value, "strftime") else None
+
+
+def _totals_key(data):
+    if not data or data.get("type") not in BUDGET_TYPES: return None
+    month_year = _month_of(data)
+    if not month_year: return None
+    return (data.get("user"), data.get("type"), normalize_category(data.get("category")), month_year)
+
+
+class BudgetTracker:
+    def __init__(self, db, gateway, send_interval=SEND_INTERVAL):
+        self.db = db
+        self.gateway = gateway
+        self.send_interval = send_interval
+        self._lock = threading.RLock()
+        self._send_lock = threading.Lock()  # Um envio em andamento termina antes de uma remontagem dos totais
+        self._loaded = False
+        self.needs_rebuild = False
+        self._limits = {}  # (usuário, tipo, categoria) -> limite
+        self._totals = {}  # (usuário, tipo, categoria, mês) -> total corrente
+        self._unsent = {}  # (usuário, tipo, categoria, mês) -> soma dos incrementos ainda não enviados
+        self._wake = threading.Event()
+        self._sender = threading.Thread(target=self._run, name="budget-totals", daemon=True)
+        self._sender.start()
+
+    def ensure_loaded(self):
+        with self._lock:
+            if self._loaded: return
+            for _, data in self.gateway.stream("budgets").rows:
+                self._limits[(data["user"], data["type"], data["category"])] = float(data["limit"])
+            totals_rows = self.gateway.stream("budget_totals").rows
+            for _, data in totals_rows:
+                self._totals[(data["user"], data["type"], data["category"], data["month_year"])] = float(data.get("total") or 0)
+            # Sem totais gravados (primeiro uso): serão montados uma única vez a partir do histórico
+            self.needs_rebuild = not totals_rows
+            self._loaded = True
+
+    def invalidate(self):
+        # Chamado quando uma escrita otimista falha: os totais são remontados na próxima leitura completa
+        with self._lock: self.needs_rebuild = True
+
+    def rebuild_totals(self, rows):
+        with self._send_lock, self._lock:
+            if not self.needs_rebuild: return  # Outra sessão já remontou
+            totals = {}
+            for data in rows:
+                key = _totals_key(data)
+                if key: totals[key] = totals.get(key, 0.0) + float(data.get("amount") or 0)
+            # Totais que sumiram (ex.: lançamentos excluídos) são zerados no banco
+            items = list(totals.items()) + [(key, 0.0) for key in self._totals if key not in totals]
+            self._totals = totals
+            self._unsent = {}  # Os totais absolutos já incluem os incrementos não enviados
+            self.needs_rebuild = False
+        for start in range(0, len(items), _BATCH_SIZE):
+            batch = self.db.batch()
+            for (user, trans_type, category, month_year), total in items[start:start + _BATCH_SIZE]:
+                batch.set(self.db.collection("budget_totals").document(_doc_id(user, trans_type, category, month_year)),
+                          {"user": user, "type": trans_type, "category": category, "month_year": month_year, "total": total})
+            self.gateway.run_write(batch.commit)
+
+    # --- Escrita ---
+    def _increment(self, key, delta):
+        user, trans_type, category, month_year = key
+        old_level = alert_level(self._totals.get(key, 0.0), self._limits.get(key[:3]))
+        self._totals[key] = self._totals.get(key, 0.0) + delta
+        new_level = alert_level(self._totals[key], self._limits.get(key[:3]))
+        # O clique não espera o banco: o incremento vai na próxima rodada de envio
+        self._unsent[key] = self._unsent.get(key, 0.0) + delta
+        self._wake.set()
+        if new_level and new_level != old_level:
+            return {"user": user, "type": trans_type, "category": category, "month_year": month_year,
+                    "total": self._totals[key], "limit": self._limits[key[:3]], "level": new_level}
+        return None
+
+    def apply_change(self, old_data=None, new_data=None):
+        # old_data/new_data: o lançamento antes e depois da escrita (None para inclusão/exclusão)
+        self.ensure_loaded()
+        deltas = {}
+        old_key, new_key = _totals_key(old_data), _totals_key(new_data)
+        if old_key: deltas[old_key] = deltas.get(old_key, 0.0) - float(old_data.get("amount") or 0)
+        if new_key: deltas[new_key] = deltas.get(new_key, 0.0) + float(new_data.get("amount") or 0)
+        triggered = []
+        with self._lock:
+            for key, delta in deltas.items():
+                if not delta: continue
+                alert = self._increment(key, delta)
+                if alert: triggered.append(alert)
+        return triggered
+
+    # --- Envio em segundo plano ---
+    def _run(self):
+        while True:
+            self._wake.wait(self.send_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Erro inesperado no envio dos totais do orçamento: {e}")
+
+    def _totals_doc(self, key, total):
+        user, trans_type, category, month_year = key
+        return self.db.collection("budget_totals").document(_doc_id(*key)), {
+            "user": user, "type": trans_type, "category": category, "month_year": month_year, "total": total}
+
+    def flush(self):
+        with self._send_lock:
+            with self._lock: unsent, self._unsent = self._unsent, {}
+            for key, delta in unsent.items():
+                if not delta: continue
+                doc_ref, data = self._totals_doc(key, firestore.Increment(delta))
+                try:
+                    # Increment não é idempotente, por isso não passa pelas retentativas do gateway
+                    doc_ref.set(data, merge=True)
+                except Exception as e:
+                    print(f"Erro ao enviar o incremento do orçamento {key}: {e}")
+                    self._write_total(key)
+
+    def _write_total(self, key):
+        # Não se sabe se o incremento chegou ao banco: grava o total absoluto, que pode ser repetido.
+        # Os incrementos da mesma chave ainda não enviados já estão nele
+        with self._lock:
+            self._unsent.pop(key, None)
+            doc_ref, data = self._totals_doc(key, self._totals.get(key, 0.0))
+        try:
+            self.gateway.run_write(lambda: doc_ref.set(data))
+        except Exception as e:
+            print(f"Erro ao gravar o total do orçamento {key}: {e}")
+            self.invalidate()
+
+    # --- Limites ---
+    def set_budget(self, user, trans_type, category, limit):
+        self.ensure_loaded()
+        category = normalize_category(category)
+        self.gateway.run_write(lambda: self.db.collection("budgets").document(_doc_id(user, trans_type, category)).set(
+            {"user": user, "type": trans_type, "category": category, "limit": float(limit)}))
+        with self._lock: self._limits[(user, trans_type, category)] = float(limit)
+
+    def delete_budget(self, user, trans_type, category):
+        self.ensure_loaded()
+        self.gateway.run_write(lambda: self.db.collection("budgets").document(_doc_id(user, trans_type, category)).delete())
+        with self._lock: self._limits.pop((user, trans_type, category), None)
+
+    # --- Leitura (somente memória) ---
+    def budgets_for(self, user, month_year):
+        self.ensure_loaded()
+        with self._lock:
+            result = []
+            for (budget_user, trans_type, category), limit in sorted(self._limits.items()):
+                if budget_user != user: continue
+                total = self._totals.get((user, trans_type, category, month_year), 0.0)
+                result.append({"user": user, "type": trans_type, "category": category, "month_year": month_year,
+                               "total": total, "limit": limit, "level": alert_level(total, limit)})
+        return result
+
+    def alerts_for(self, users, month_year):
+        return [budget for user in users for budget in self.budgets_for(user, month_year) if budget["level"]]
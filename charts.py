@@ -0,0 +1,74 @@
+"""Séries de longo prazo e gráficos WebGL com redução de pontos no servidor.
+
+O histórico pode ter milhares de dias; em vez de mandar tudo ao navegador, a
+janela escolhida é reduzida com LTTB (Largest-Triangle-Three-Buckets) para um
+número fixo de pontos. Janelas maiores ficam com resolução menor, de modo que o
+tamanho do gráfico não cresce com o histórico.
+"""
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+
+MAX_CHART_POINTS = 800
+SIGNED_TYPES = {"Receita": 1, "Despesa": -1, "Investimento": -1}  # Mesma conta do "Saldo Final"
+
+
+def lttb_indices(x, y, threshold):
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    # O primeiro e o último ponto são mantidos; o meio é dividido em threshold - 2 faixas
+    edges = np.linspace(1, n - 1, threshold - 1).astype(int)
+    selected = np.empty(threshold, dtype=int)
+    selected[0], selected[-1] = 0, n - 1
+    anchor = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        next_start, next_end = (edges[i + 1], edges[i + 2]) if i + 2 < len(edges) else (n - 1, n)
+        avg_x, avg_y = x[next_start:next_end].mean(), y[next_start:next_end].mean()
+        areas = np.abs((x[anchor] - avg_x) * (y[start:end] - y[anchor]) - (x[anchor] - x[start:end]) * (avg_y - y[anchor]))
+        anchor = start + int(areas.argmax()) if end > start else start
+        selected[i + 1] = anchor
+    return selected
+
+
+def downsample(series, max_points=MAX_CHART_POINTS):
+    if len(series) <= max_points:
+        return series
+    x = series.index.values.astype("datetime64[s]").astype(np.int64)
+    return series.iloc[lttb_indices(x, series.values, max_points)]
+
+
+def daily_balance_series(df_transactions):
+    if df_transactions.empty:
+        return pd.Series(dtype=float)
+    signs = df_transactions['type'].map(SIGNED_TYPES).fillna(0)
+    daily = (df_transactions['amount'] * signs).groupby(pd.to_datetime(df_transactions['date']).dt.normalize()).sum()
+    full_range = pd.date_range(daily.index.min(), daily.index.max(), freq="D")
+    return daily.reindex(full_range, fill_value=0).cumsum()
+
+
+def monthly_totals(df_transactions, transaction_type):
+    selected = df_transactions[df_transactions['type'] == transaction_type]
+    if selected.empty:
+        return pd.Series(dtype=float)
+    monthly = selected.groupby(pd.to_datetime(selected['date']).dt.to_period("M"))['amount'].sum()
+    monthly.index = monthly.index.to_timestamp()
+    return monthly
+
+
+def window(series, start, end):
+    if series.empty:
+        return series
+    return series[(series.index >= start) & (series.index <= end)]
+
+
+def scattergl_figure(named_series, title, colors, mode="lines"):
+    fig = go.Figure()
+    for name, series in named_series.items():
+        fig.add_trace(go.Scattergl(x=series.index, y=series.values, name=name, mode=mode,
+                                   line={"color": colors.get(name)}, hovertemplate="%{x|%d/%m/%Y}<br>R$ %{y:,.2f}<extra></extra>"))
+    fig.update_layout(title=title, xaxis_title="Data", yaxis_title="Valor (R$)", hovermode="x unified")
+    return fig
@@ -0,0 +1,300 @@
+"""Camada de dados e análises independente do Streamlit.
+
+Usada pelo app (financeiro.py) e pelo gerador de relatórios (reports.py). As
+funções levantam exceções em vez de exibir mensagens; quem chama decide como
+mostrá-las.
+"""
+import calendar
+import datetime
+import json
+import os
+
+import firebase_admin
+import pandas as pd
+from firebase_admin import credentials, firestore
+
+from archives import ARCHIVED_COLLECTION, MonthArchiver, merge_rows
+from firestore_access import QueryResult
+
+PORTUGUESE_MONTHS = [
+    "Janeiro", "Fevereiro", "Março", "Abril", "Maio", "Junho",
+    "Julho", "Agosto", "Setembro", "Outubro", "Novembro", "Dezembro"
+]
+TRANSACTION_TYPES = ["Receita", "Despesa", "Investimento"]
+PAYMENT_STATUS_OPTIONS = ["Pendente", "Pago"]
+MOTO_EXPENSE_TYPES = ["Manutenção Preventiva", "Manutenção Corretiva", "Peça", "Acessório", "Documentação", "Combustível", "Outros"]
+# Campos que entram nos totais, gráficos e orçamentos; mudar só os demais (status, descrição) não altera os resumos
+TOTALS_FIELDS = {
+    "transactions": ("user", "date", "type", "category", "amount", "month_year"),
+    "moto_transactions": ("user", "date", "expense_type", "amount", "mileage", "liters"),
+}
+TRANSACTION_COLUMNS = ["id", "user", "date", "type", "category", "description", "amount", "month_year", "status_pagamento"]
+MOTO_COLUMNS = ["id", "user", "date", "expense_type", "description", "amount", "mileage", "liters"]
+
+
+class ValidationError(ValueError):
+    pass
+
+
+# --- Formatação ---
+def format_month_year_for_display(month_year_str):
+    if not month_year_str or len(month_year_str) != 7 or month_year_str[4] != '-': return month_year_str
+    try:
+        year, month = map(int, month_year_str.split('-'))
+        if not (1 <= month <= 12): return month_year_str
+        return f"{PORTUGUESE_MONTHS[month-1]} de {year}"
+    except (ValueError, IndexError): return month_year_str
+
+def parse_display_month_year(display_month_year_str):
+    try:
+        parts = display_month_year_str.split(" de ")
+        if len(parts) != 2: return None
+        month_name_pt, year_str = parts[0], parts[1]
+        if month_name_pt not in PORTUGUESE_MONTHS: return None
+        month_num = PORTUGUESE_MONTHS.index(month_name_pt) + 1
+        year_num = int(year_str)
+        return f"{year_num:04d}-{month_num:02d}"
+    except Exception: return None
+
+def format_currency_manual(value):
+    try:
+        val_float = float(value)
+        formatted_string = f"{val_float:_.2f}".replace('.', ',').replace('_', '.')
+        return f"R$ {formatted_string}"
+    except Exception: return f"R$ {value:.2f}"
+
+
+# --- Repositório (Firestore) ---
+def connect_firestore(credentials_path=None):
+    # Para uso fora do Streamlit (relatórios, compactação); o app usa os Streamlit Secrets
+    if not firebase_admin._apps:
+        if credentials_path: cred = credentials.Certificate(credentials_path)
+        else:
+            creds_json_str = os.environ.get("FIREBASE_SERVICE_ACCOUNT_JSON")
+            if not creds_json_str: raise SystemExit("Informe --credentials ou a variável FIREBASE_SERVICE_ACCOUNT_JSON.")
+            cred = credentials.Certificate(json.loads(creds_json_str))
+        firebase_admin.initialize_app(cred)
+    return firestore.client()
+
+def _installment_date(date_obj, month_offset):
+    year = date_obj.year + (date_obj.month - 1 + month_offset) // 12
+    month = (date_obj.month - 1 + month_offset) % 12 + 1
+    day = min(date_obj.day, calendar.monthrange(year, month)[1])
+    return datetime.date(year, month, day)
+
+def _written(data):
+    # O que o cache do gateway recebe de uma escrita: valores calculados pelo servidor ficam de fora
+    return {field: value for field, value in data.items() if value is not firestore.SERVER_TIMESTAMP}
+
+
+class FinanceRepository:
+    def __init__(self, db, gateway, archives=None):
+        self.db = db
+        self.gateway = gateway
+        self.archives = archives or MonthArchiver(db, gateway)
+
+    def rows(self, collection, max_age=None):
+        result = self.gateway.stream(collection, order_by="date", direction=firestore.Query.DESCENDING, max_age=max_age)
+        if collection != ARCHIVED_COLLECTION: return result
+        # Meses quentes vêm dos documentos individuais; os fechados, dos arquivos compactados
+        archived = self.archives.load(max_age)
+        return QueryResult(merge_rows(result.rows, archived.rows), min(result.fetched_at, archived.fetched_at),
+                           result.stale or archived.stale)
+
+    # --- Transações ---
+    def save_transaction(self, user, date_obj, transaction_type, category, description, amount, payment_status=None):
+        timestamp_obj = datetime.datetime.combine(date_obj, datetime.datetime.min.time())
+        doc_ref = self.db.collection("transactions").document()
+        data_to_save = {
+            "user": user, "date": timestamp_obj, "type": transaction_type,
+            "category": category.strip().capitalize(), "description": description.strip(),
+            "amount": float(amount), "month_year": date_obj.strftime("%Y-%m"),
+            "created_at": firestore.SERVER_TIMESTAMP
+        }
+        if transaction_type == "Despesa":
+            data_to_save["status_pagamento"] = payment_status if payment_status else "Pendente"
+        self.gateway.run_write(lambda: doc_ref.set(data_to_save))
+        self.gateway.record_write("transactions", doc_ref.id, _written(data_to_save), replace=True)
+        return doc_ref.id, data_to_save
+
+    def add_transaction(self, user, date_obj, transaction_type, category, description, amount, is_recurring, num_installments,
+                        payment_status=None, on_saved=None):
+        # on_saved(doc_id, dados) é chamado a cada documento gravado, mesmo que uma parcela seguinte falhe
+        if not category or amount <= 0: raise ValidationError("Preencha a categoria e um valor positivo para a parcela.")
+        saved = []
+        if is_recurring and num_installments > 1:
+            for i in range(num_installments):
+                installment_description = f"{description} (Parcela {i+1}/{num_installments})" if description else f"Parcela {i+1}/{num_installments} de {category}"
+                installment_status = payment_status if i == 0 and transaction_type == "Despesa" else "Pendente"
+                if transaction_type != "Despesa": installment_status = None
+                saved.append(self.save_transaction(user, _installment_date(date_obj, i), transaction_type, category,
+                                                   installment_description, amount, installment_status))
+                if on_saved: on_saved(*saved[-1])
+        else:
+            final_description = description
+            if is_recurring and num_installments == 1:
+                final_description = f"{description} (Parcela 1/1)" if description else f"Parcela 1/1 de {category}"
+            saved.append(self.save_transaction(user, date_obj, transaction_type, category, final_description, amount,
+                                               payment_status if transaction_type == "Despesa" else None))
+            if on_saved: on_saved(*saved[-1])
+        return saved
+
+    def delete_transaction(self, transaction_id):
+        self.gateway.run_write(lambda: self.archives.guarded_delete(transaction_id))
+        self.gateway.record_write("transactions", transaction_id)
+
+    def update_transaction(self, transaction_id, data_to_update):
+        data_to_update = {**data_to_update, "updated_at": firestore.SERVER_TIMESTAMP}
+        doc_ref = self.db.collection("transactions").document(transaction_id)
+        self.archives.guarded_write(transaction_id, lambda: self.gateway.run_write(lambda: doc_ref.update(data_to_update)))
+        self.gateway.record_write("transactions", transaction_id, _written(data_to_update))
+
+    def update_payment_status(self, transaction_id, new_status):
+        self.update_transaction(transaction_id, {"status_pagamento": new_status})
+
+    # --- Moto ---
+    def add_moto_transaction(self, user, date_obj, expense_type, description, amount, mileage, liters=None):
+        if not expense_type or not description or amount <= 0:
+            raise ValidationError("Preencha todos os campos obrigatórios com valores válidos.")
+        timestamp_obj = datetime.datetime.combine(date_obj, datetime.datetime.min.time())
+        doc_ref = self.db.collection("moto_transactions").document()
+        data_to_save = {
+            "user": user, "date": timestamp_obj, "expense_type": expense_type,
+            "description": description.strip(), "amount": float(amount),
+            "mileage": int(mileage) if mileage else None,
+            "created_at": firestore.SERVER_TIMESTAMP
+        }
+        if expense_type == "Combustível" and liters is not None and liters > 0:
+            data_to_save["liters"] = float(liters)
+        self.gateway.run_write(lambda: doc_ref.set(data_to_save))
+        self.gateway.record_write("moto_transactions", doc_ref.id, _written(data_to_save), replace=True)
+        return doc_ref.id, data_to_save
+
+    def delete_moto_transaction(self, transaction_id):
+        self.gateway.run_write(lambda: self.db.collection("moto_transactions").document(transaction_id).delete())
+        self.gateway.record_write("moto_transactions", transaction_id)
+
+    def update_moto_transaction(self, transaction_id, data_to_update):
+        data_to_update = {**data_to_update, "updated_at": firestore.SERVER_TIMESTAMP}
+        self.gateway.run_write(lambda: self.db.collection("moto_transactions").document(transaction_id).update(data_to_update))
+        self.gateway.record_write("moto_transactions", transaction_id, _written(data_to_update))
+
+
+# --- Conversão para DataFrame ---
+def transactions_frame(rows):
+    transactions_list = []
+    for doc_id, data in rows:
+        data["id"] = doc_id
+        if 'date' in data and isinstance(data['date'], datetime.datetime):
+            data['date'] = data['date'].date()
+        if data.get('type') == "Despesa" and 'status_pagamento' not in data:
+            data['status_pagamento'] = "Pendente"
+        transactions_list.append(data)
+    df = pd.DataFrame(transactions_list)
+    if df.empty: return pd.DataFrame(columns=TRANSACTION_COLUMNS)
+    if 'date' in df.columns: df['date'] = pd.to_datetime(df['date'])
+    if 'amount' in df.columns: df['amount'] = pd.to_numeric(df['amount'])
+    return df
+
+def moto_transactions_frame(rows):
+    transactions_list = []
+    for doc_id, data in rows:
+        data["id"] = doc_id
+        if 'date' in data and isinstance(data['date'], datetime.datetime):
+            data['date'] = data['date'].date()
+        transactions_list.append(data)
+    if not transactions_list: return pd.DataFrame(columns=MOTO_COLUMNS)
+    df = pd.DataFrame(transactions_list)
+    # Garante que a coluna 'liters' existe, preenchendo com NA se estiver ausente (para dados antigos)
+    if 'liters' not in df.columns: df['liters'] = pd.NA
+    if 'date' in df.columns: df['date'] = pd.to_datetime(df['date'])
+    if 'amount' in df.columns: df['amount'] = pd.to_numeric(df['amount'])
+    if 'mileage' in df.columns: df['mileage'] = pd.to_numeric(df['mileage'])
+    if 'liters' in df.columns: df['liters'] = pd.to_numeric(df['liters'])
+    return df
+
+def with_month_year(df):
+    df = df.copy()
+    if 'date' in df.columns: df['month_year'] = pd.to_datetime(df['date']).dt.strftime('%Y-%m')
+    return df
+
+def month_options(df, current_month_internal):
+    # Meses com lançamentos mais o mês corrente, do mais recente para o mais antigo
+    months = set(df['month_year'].unique()) if not df.empty else set()
+    months.add(current_month_internal)
+    return sorted(months, reverse=True)
+
+
+# --- Análises ---
+def _comparable(value):
+    if value is None: return None
+    if isinstance(value, (datetime.date, pd.Timestamp)): return pd.Timestamp(value)
+    if isinstance(value, str): return value.strip()
+    try:
+        if pd.isna(value): return None
+    except (TypeError, ValueError): pass
+    return float(value) if isinstance(value, (int, float)) else value
+
+def totals_changed(collection, old_data, new_data):
+    # Inclusão, exclusão ou dado anterior desconhecido: trata como mudança
+    if old_data is None or new_data is None: return True
+    return any(_comparable(old_data.get(field)) != _comparable(new_data.get(field)) for field in TOTALS_FIELDS[collection])
+
+def month_summary(df_period):
+    receitas = df_period[df_period['type'] == 'Receita']['amount'].sum()
+    despesas = df_period[df_period['type'] == 'Despesa']['amount'].sum()
+    investimentos = df_period[df_period['type'] == 'Investimento']['amount'].sum()
+    return {"receitas": receitas, "despesas": despesas, "investimentos": investimentos,
+            "saldo": receitas - (despesas + investimentos)}
+
+def composition_breakdown(receitas, despesas_total):
+    # Valores, rótulos, cores e título do gráfico de composição Receita vs. Despesa
+    chart_values, chart_names, chart_colors, chart_title = [], [], [], "Situação Financeira do Mês"
+    if receitas == 0 and despesas_total > 0:
+        chart_values, chart_names, chart_colors = [despesas_total], ['Despesas (Sem Receita)'], ['crimson']
+        chart_title = "Situação Financeira: Déficit (Sem Receita)"
+    elif receitas > 0:
+        if despesas_total <= receitas:
+            chart_values = [despesas_total, receitas - despesas_total]
+            chart_names = ['Despesas Cobertas', 'Saldo Positivo da Receita']
+            chart_colors = ['sandybrown', 'lightgreen']
+            chart_title = "Receita vs. Despesa: Saldo Positivo"
+            if despesas_total == 0 and (receitas - despesas_total) == 0: pass
+            elif despesas_total == 0 : chart_values, chart_names, chart_colors = [receitas - despesas_total], ['Saldo Positivo da Receita'], ['lightgreen']
+            elif (receitas - despesas_total) == 0: chart_values, chart_names, chart_colors = [despesas_total], ['Despesas (Cobriram 100% da Receita)'], ['sandybrown']
+        else:
+            chart_values = [receitas, despesas_total - receitas]
+            chart_names = ['Receita (Coberta)', 'Despesa Excedente (Déficit)']
+            chart_colors = ['lightcoral', 'crimson']
+            chart_title = "Receita vs. Despesa: Déficit"
+    return chart_values, chart_names, chart_colors, chart_title
+
+def monthly_history(df_history, selected_month_internal, num_months=12):
+    # Receitas e despesas por mês nos num_months meses com dados até o mês escolhido.
+    # Levanta ValueError se o mês não existe no histórico.
+    df_history = with_month_year(df_history)
+    all_months = sorted(df_history['month_year'].unique())
+    end_index = all_months.index(selected_month_internal)
+    months_for_chart = all_months[max(0, end_index - (num_months - 1)): end_index + 1]
+    history = df_history[df_history['month_year'].isin(months_for_chart) & df_history['type'].isin(['Receita', 'Despesa'])]
+    if history.empty: return pd.DataFrame(columns=['month_year', 'Receita', 'Despesa'])
+    monthly_summary = history.groupby(['month_year', 'type'])['amount'].sum().unstack(fill_value=0).reset_index()
+    if 'Receita' not in monthly_summary.columns: monthly_summary['Receita'] = 0
+    if 'Despesa' not in monthly_summary.columns: monthly_summary['Despesa'] = 0
+    return monthly_summary.sort_values(by='month_year')
+
+def moto_stats(df_moto):
+    stats = {"total_cost": df_moto['amount'].sum(), "cost_per_km": 0, "km_per_liter": 0,
+             "costs_by_type": df_moto.groupby('expense_type')['amount'].sum().reset_index()}
+    df_with_mileage = df_moto.dropna(subset=['mileage'])
+    if not df_with_mileage.empty and df_with_mileage['mileage'].nunique() > 1:
+        # Filtra apenas para despesas de combustível com quilometragem e litros
+        df_fuel_for_calc = df_with_mileage[(df_with_mileage['expense_type'] == 'Combustível') & (df_with_mileage['liters'].notna()) & (df_with_mileage['liters'] > 0)]
+        total_fuel_cost = df_fuel_for_calc['amount'].sum()
+        total_liters = df_fuel_for_calc['liters'].sum()
+        # A distância percorrida é calculada com base em todas as entradas de KM
+        distance_traveled = df_with_mileage['mileage'].max() - df_with_mileage['mileage'].min()
+        if distance_traveled > 0:
+            if total_fuel_cost > 0: stats["cost_per_km"] = total_fuel_cost / distance_traveled  # Custo de combustível por KM
+            if total_liters > 0: stats["km_per_liter"] = distance_traveled / total_liters  # Consumo em KM por Litro
+    return stats
@@ -1,12 +1,23 @@
 import streamlit as st
+from streamlit.errors import StreamlitAPIException
 import pandas as pd
 import datetime
 import plotly.express as px
+import charts
 import firebase_admin
 from firebase_admin import credentials, firestore
 import json
-import calendar 
 import locale # Para formatação de moeda
+import math
+import time
+from firestore_access import FirestoreGateway, ReadBudgetExceeded, DEFAULT_DAILY_READ_BUDGET
+from write_behind import WriteBehindQueue, DEFAULT_QUEUE_PATH
+from search_index import SearchIndex
+from budgets import BudgetTracker, BUDGET_TYPES, LEVEL_EXCEEDED
+from archives import MonthArchiver
+import finance_data
+from finance_data import (FinanceRepository, ValidationError, TRANSACTION_TYPES, PAYMENT_STATUS_OPTIONS, MOTO_EXPENSE_TYPES,
+                          format_month_year_for_display, parse_display_month_year)
 
 # --- Configuração da Página ---
 st.set_page_config(layout="wide")
@@ -15,13 +26,9 @@ st.set_page_config(layout="wide")
 # --- Configurações Iniciais e Autenticação (Usuários) ---
 USERS = {"Luiz": "1517", "Iasmin": "1516"}
 
-PORTUGUESE_MONTHS = [
-    "Janeiro", "Fevereiro", "Março", "Abril", "Maio", "Junho",
-    "Julho", "Agosto", "Setembro", "Outubro", "Novembro", "Dezembro"
-]
-
-PAYMENT_STATUS_OPTIONS = ["Pendente", "Pago"] 
-MOTO_EXPENSE_TYPES = ["Manutenção Preventiva", "Manutenção Corretiva", "Peça", "Acessório", "Documentação", "Combustível", "Outros"]
+SEARCH_FIELDS = ("description", "category", "expense_type")
+SEARCH_PAGE_SIZE = 25
+LONG_RANGE_OPTIONS = {"3 meses": 3, "6 meses": 6, "1 ano": 12, "3 anos": 36, "Tudo": None}
 
 # Tenta definir o locale para Português do Brasil
 LOCALE_SET_SUCCESS = False
@@ -60,6 +67,54 @@ def initialize_firebase():
 
 db = initialize_firebase() 
 
+@st.cache_resource
+def get_firestore_gateway():
+    # Uma única instância por processo: coalescência, retentativas e orçamento valem para todas as sessões
+    daily_read_budget = st.secrets.get("FIRESTORE_DAILY_READ_BUDGET", DEFAULT_DAILY_READ_BUDGET)
+    return FirestoreGateway(db, daily_read_budget=int(daily_read_budget) if daily_read_budget else None)
+
+gateway = get_firestore_gateway() if db else None
+
+@st.cache_resource
+def get_month_archiver():
+    # Sabe em qual arquivo compactado está cada lançamento de mês fechado (ver archives.py)
+    return MonthArchiver(db, gateway)
+
+month_archiver = get_month_archiver() if db else None
+repository = FinanceRepository(db, gateway, month_archiver) if db else None
+
+@st.cache_resource
+def get_budget_tracker():
+    # Limites, totais correntes e alertas ficam em memória, compartilhados pelas sessões
+    return BudgetTracker(db, gateway)
+
+budget_tracker = get_budget_tracker() if db else None
+
+@st.cache_resource
+def get_search_index():
+    return SearchIndex(SEARCH_FIELDS)
+
+search_index = get_search_index()
+
+@st.cache_resource
+def get_write_queue():
+    # Fila do modo otimista, compartilhada pelas sessões; a thread de envio vive com o processo
+    tracker, archiver, index = get_budget_tracker(), get_month_archiver(), get_search_index()
+    def on_failure(entry):
+        # O índice já mostrava a alteração descartada: a próxima leitura da coleção é comparada por inteiro
+        index.invalidate(entry.collection)
+        if entry.collection == "transactions": tracker.invalidate()
+    def write_guard(entry, write):
+        # Lançamentos podem estar num mês arquivado (ver archives.py)
+        if entry.collection != "transactions": return write()
+        if entry.op == "delete": return archiver.guarded_delete(entry.doc_id)
+        return archiver.guarded_write(entry.doc_id, write)
+    return WriteBehindQueue(db, gateway, st.secrets.get("WRITE_BEHIND_QUEUE_PATH", DEFAULT_QUEUE_PATH),
+                            on_failure=on_failure, write_guard=write_guard)
+
+write_queue = get_write_queue() if db else None
+SNAPSHOT_REUSE_MAX_AGE = 300 # Segundos que um rerun otimista pode reaproveitar a última leitura
+
 # --- Inicialização do Estado da Sessão ---
 def initialize_app_session_state():
     if 'logged_in' not in st.session_state: st.session_state.logged_in = False
@@ -71,30 +126,15 @@ def initialize_app_session_state():
     if 'transaction_mode_selection_key' not in st.session_state: st.session_state.transaction_mode_selection_key = "Único"
     if 'last_main_menu_selection' not in st.session_state: st.session_state.last_main_menu_selection = None
     if 'moto_expense_type_key' not in st.session_state: st.session_state.moto_expense_type_key = MOTO_EXPENSE_TYPES[0]
+    if 'optimistic_mode' not in st.session_state: st.session_state.optimistic_mode = True
+    if 'reuse_snapshot' not in st.session_state: st.session_state.reuse_snapshot = False
+    if 'budget_toasts' not in st.session_state: st.session_state.budget_toasts = []
+    if 'row_overrides' not in st.session_state: st.session_state.row_overrides = {}
 
 
 initialize_app_session_state()
 
 # --- Funções Auxiliares de Formatação ---
-def format_month_year_for_display(month_year_str):
-    if not month_year_str or len(month_year_str) != 7 or month_year_str[4] != '-': return month_year_str 
-    try:
-        year, month = map(int, month_year_str.split('-'))
-        if not (1 <= month <= 12): return month_year_str 
-        return f"{PORTUGUESE_MONTHS[month-1]} de {year}"
-    except (ValueError, IndexError): return month_year_str 
-
-def parse_display_month_year(display_month_year_str):
-    try:
-        parts = display_month_year_str.split(" de ")
-        if len(parts) != 2: return None
-        month_name_pt, year_str = parts[0], parts[1]
-        if month_name_pt not in PORTUGUESE_MONTHS: return None
-        month_num = PORTUGUESE_MONTHS.index(month_name_pt) + 1
-        year_num = int(year_str)
-        return f"{year_num:04d}-{month_num:02d}"
-    except Exception: return None
-
 def format_brazilian_currency(value):
     global LOCALE_SET_SUCCESS
     if LOCALE_SET_SUCCESS:
@@ -104,11 +144,7 @@ def format_brazilian_currency(value):
             if 'pt_BR_runtime_warning_shown' not in st.session_state: 
                 print("Aviso: Falha ao usar formatação de moeda do locale em tempo de execução. Usando formatação manual.")
                 st.session_state.pt_BR_runtime_warning_shown = True
-    try:
-        val_float = float(value) 
-        formatted_string = f"{val_float:_.2f}".replace('.', ',').replace('_', '.')
-        return f"R$ {formatted_string}"
-    except Exception: return f"R$ {value:.2f}"
+    return finance_data.format_currency_manual(value)
 
 
 # --- Funções de Autenticação ---
@@ -124,189 +160,203 @@ def logout_user():
     keys_to_clear = ['logged_in', 'user', 'editing_transaction', 'pending_delete_id', 
                      'editing_moto_transaction', 'pending_delete_moto_id', 
                      'last_main_menu_selection', 'my_summary_month_select', 
-                     'couple_summary_month_select']
+                     'couple_summary_month_select', 'reuse_snapshot']
     for key in keys_to_clear:
         if key in st.session_state:
             del st.session_state[key]
     st.rerun()
 
-# --- Funções CRUD (Geral e Moto) ---
-def _save_single_transaction_to_firestore_internal(user, date_obj, transaction_type, category, description, amount, payment_status=None):
-    if not db: st.error("Conexão com o banco de dados falhou ao salvar."); return
-    timestamp_obj = datetime.datetime.combine(date_obj, datetime.datetime.min.time())
-    doc_ref = db.collection("transactions").document() 
-    data_to_save = {
-        "user": user, "date": timestamp_obj, "type": transaction_type,
-        "category": category.strip().capitalize(), "description": description.strip(),
-        "amount": float(amount), "month_year": date_obj.strftime("%Y-%m"), 
-        "created_at": firestore.SERVER_TIMESTAMP 
-    }
-    if transaction_type == "Despesa":
-        data_to_save["status_pagamento"] = payment_status if payment_status else "Pendente"
-    doc_ref.set(data_to_save)
+# --- Orçamentos ---
+def track_budget_change(old_data=None, new_data=None):
+    # Avaliação incremental: só a categoria/mês afetados pela escrita são recalculados
+    try:
+        alerts = budget_tracker.apply_change(old_data, new_data)
+    except Exception as e:
+        budget_tracker.invalidate()
+        st.warning(f"Não foi possível atualizar os totais do orçamento: {e}"); return
+    for alert in alerts:
+        message = (f"Orçamento de {alert['category']} em {format_month_year_for_display(alert['month_year'])}: "
+                   f"{format_brazilian_currency(alert['total'])} de {format_brazilian_currency(alert['limit'])}")
+        if alert['level'] == LEVEL_EXCEEDED: message = f"🚨 {message} — limite excedido!"
+        else: message = f"⚠️ {message} — perto do limite."
+        st.session_state.budget_toasts.append(message) # Exibidos no fim do rerun, que pode ser reiniciado por st.rerun()
+
+def display_budget_badges(users, month_year):
+    alerts = budget_tracker.alerts_for(users, month_year)
+    if not alerts: return
+    badges = []
+    for alert in alerts:
+        exceeded = alert['level'] == LEVEL_EXCEEDED
+        owner = f"{alert['user']}: " if len(users) > 1 else ""
+        percent = alert['total'] / alert['limit'] * 100
+        badges.append(f":{'red' if exceeded else 'orange'}-badge[{'🚨' if exceeded else '⚠️'} {owner}{alert['category']} {percent:.0f}%]")
+    st.markdown("**Orçamentos:** " + " ".join(badges))
 
+# --- Funções CRUD (Geral e Moto) ---
+# A gravação e as regras ficam em finance_data; aqui ficam as mensagens, os reruns, o modo otimista e os efeitos na sessão
 def add_transaction(user, date_obj, transaction_type, category, description, amount, is_recurring, num_installments, payment_status=None):
     if not db: st.error("Conexão com o banco de dados não estabelecida."); return
-    if not category or amount <= 0: st.warning("Preencha a categoria e um valor positivo para a parcela."); return
-
     try:
-        if is_recurring and num_installments > 1:
-            original_description = description 
-            amount_per_installment = amount 
-            for i in range(num_installments):
-                current_month_offset = i 
-                year_of_installment = date_obj.year + (date_obj.month - 1 + current_month_offset) // 12
-                month_of_installment = (date_obj.month - 1 + current_month_offset) % 12 + 1
-                day_of_installment = min(date_obj.day, calendar.monthrange(year_of_installment, month_of_installment)[1])
-                current_installment_date = datetime.date(year_of_installment, month_of_installment, day_of_installment)
-                installment_description = f"{original_description} (Parcela {i+1}/{num_installments})" if original_description else f"Parcela {i+1}/{num_installments} de {category}"
-                current_payment_status_for_installment = payment_status if i == 0 and transaction_type == "Despesa" else "Pendente"
-                if transaction_type != "Despesa": current_payment_status_for_installment = None
-                _save_single_transaction_to_firestore_internal(
-                    user, current_installment_date, transaction_type, category, 
-                    installment_description, amount_per_installment, current_payment_status_for_installment
-                )
-            st.success(f"{num_installments} parcelas de '{category}' adicionadas com sucesso!")
-        else:
-            final_description = description 
-            if is_recurring and num_installments == 1: 
-                 final_description = f"{description} (Parcela 1/1)" if description else f"Parcela 1/1 de {category}"
-            current_payment_status = payment_status if transaction_type == "Despesa" else None
-            _save_single_transaction_to_firestore_internal(
-                user, date_obj, transaction_type, category, final_description, amount, current_payment_status
-            )
-            if not (is_recurring and num_installments > 1): 
-                st.success(f"{transaction_type} '{category}' adicionada com sucesso!")
-    except Exception as e: st.error(f"Erro ao adicionar transação(ões): {e}")
+        repository.add_transaction(user, date_obj, transaction_type, category, description, amount, is_recurring, num_installments,
+                                   payment_status, on_saved=on_transaction_saved)
+    except ValidationError as e: st.warning(str(e)); return
+    except Exception as e: st.error(f"Erro ao adicionar transação(ões): {e}"); return
+    if is_recurring and num_installments > 1: rerun_with_feedback(f"{num_installments} parcelas de '{category}' adicionadas com sucesso!")
+    rerun_with_feedback(f"{transaction_type} '{category}' adicionada com sucesso!")
+
+def on_transaction_saved(doc_id, data):
+    track_budget_change(None, data)
+    search_index.apply_write("transactions", doc_id, data)
+
+def rerun_optimistically():
+    # A alteração já está na fila: o próximo rerun reaproveita a última leitura com a fila aplicada por cima
+    st.session_state.reuse_snapshot = True
+    st.rerun()
 
-def get_transactions_df():
+def rerun_with_feedback(message):
+    # Os formulários de inclusão são fragmentos: a página inteira é redesenhada para listas e totais incluírem o lançamento
+    st.session_state.entry_form_feedback = message
+    st.rerun()
+
+def show_entry_form_feedback():
+    if st.session_state.get('entry_form_feedback'): st.success(st.session_state.pop('entry_form_feedback'))
+
+def rerun_fragment():
+    try: st.rerun(scope="fragment")
+    except StreamlitAPIException: st.rerun() # O clique foi tratado numa execução completa, não na do fragmento
+
+def finish_row_action(collection, doc_id, new_data, old_data, optimistic=False):
+    # Chamado de dentro do fragmento da linha: se os totais da página não mudaram, só a linha é redesenhada
+    st.session_state.row_overrides[(collection, doc_id)] = new_data
+    if not finance_data.totals_changed(collection, old_data, new_data): rerun_fragment()
+    if optimistic: rerun_optimistically()
+    st.rerun()
+
+def load_collection_rows(collection, reuse_snapshot=False):
+    max_age = SNAPSHOT_REUSE_MAX_AGE if reuse_snapshot or st.session_state.get('reuse_snapshot') else None
+    result = repository.rows(collection, max_age=max_age)
+    warn_if_stale(result)
+    rows = write_queue.apply_pending(collection, result.rows)
+    search_index.stage(collection, rows, result.fetched_at)
+    return rows
+
+def warn_if_stale(result):
+    if result.stale:
+        st.warning(f"Limite de leituras do banco atingido ou banco indisponível. Exibindo dados em cache de {result.fetched_at.strftime('%d/%m %H:%M')}.")
+
+def get_transactions_df(reuse_snapshot=False):
     if not db: st.error("Conexão com o banco de dados não estabelecida."); return pd.DataFrame()
     try:
-        transactions_ref = db.collection("transactions").order_by("date", direction=firestore.Query.DESCENDING).stream()
-        transactions_list = []
-        for trans_doc in transactions_ref:
-            data = trans_doc.to_dict()
-            data["id"] = trans_doc.id
-            if 'date' in data and isinstance(data['date'], datetime.datetime):
-                data['date'] = data['date'].date() 
-            if data.get('type') == "Despesa" and 'status_pagamento' not in data:
-                data['status_pagamento'] = "Pendente"
-            transactions_list.append(data)
-        
-        df = pd.DataFrame(transactions_list)
-        if df.empty:
-             return pd.DataFrame(columns=["id", "user", "date", "type", "category", "description", "amount", "month_year", "status_pagamento"])
-        if 'date' in df.columns: df['date'] = pd.to_datetime(df['date'])
-        if 'amount' in df.columns: df['amount'] = pd.to_numeric(df['amount'])
+        rows = load_collection_rows("transactions", reuse_snapshot)
+        df = finance_data.transactions_frame(rows)
+        budget_tracker.ensure_loaded()
+        if budget_tracker.needs_rebuild: budget_tracker.rebuild_totals([data for _, data in rows]) # Uma única vez, no primeiro uso
         return df
+    except ReadBudgetExceeded as e: st.warning(f"{e} Tente novamente amanhã."); return pd.DataFrame()
     except Exception as e: st.error(f"Erro ao buscar transações: {e}"); return pd.DataFrame()
 
-def delete_transaction_from_firestore(transaction_id):
-    if not db: st.error("Conexão com o banco de dados não estabelecida."); return
-    try:
-        db.collection("transactions").document(transaction_id).delete()
-        st.success("Transação excluída com sucesso!")
-        st.session_state.pending_delete_id = None
-        if st.session_state.get('editing_transaction', {}).get('id') == transaction_id:
-            st.session_state.editing_transaction = None
-    except Exception as e: st.error(f"Erro ao excluir transação: {e}")
-    st.rerun()
-
-def update_transaction_in_firestore(transaction_id, data_to_update):
+def delete_transaction_from_firestore(transaction_id, label="", deleted_data=None):
     if not db: st.error("Conexão com o banco de dados não estabelecida."); return
-    try:
-        data_to_update["updated_at"] = firestore.SERVER_TIMESTAMP
-        db.collection("transactions").document(transaction_id).update(data_to_update)
-        st.success("Transação atualizada com sucesso!")
+    optimistic = st.session_state.get('optimistic_mode')
+    if optimistic: write_queue.enqueue_delete("transactions", transaction_id, st.session_state.user, label)
+    else:
+        try: repository.delete_transaction(transaction_id)
+        except Exception as e: st.error(f"Erro ao excluir transação: {e}"); return
+    track_budget_change(deleted_data, None)
+    search_index.apply_write("transactions", transaction_id)
+    st.session_state.pending_delete_id = None
+    if (st.session_state.get('editing_transaction') or {}).get('id') == transaction_id:
         st.session_state.editing_transaction = None
-    except Exception as e: st.error(f"Erro ao atualizar transação: {e}")
-    st.rerun()
+    finish_row_action("transactions", transaction_id, None, deleted_data, optimistic)
 
-def update_payment_status_in_firestore(transaction_id, new_status):
+def update_transaction_in_firestore(transaction_id, data_to_update, original_data=None):
     if not db: st.error("Conexão com o banco de dados não estabelecida."); return
-    try:
-        db.collection("transactions").document(transaction_id).update({
-            "status_pagamento": new_status,
-            "updated_at": firestore.SERVER_TIMESTAMP
-        })
-        st.success(f"Status da despesa atualizado para {new_status}!")
-    except Exception as e: st.error(f"Erro ao atualizar status do pagamento: {e}")
-    st.rerun()
+    optimistic = st.session_state.get('optimistic_mode') and original_data is not None
+    if optimistic:
+        write_queue.enqueue_update("transactions", transaction_id, data_to_update, original_data,
+                                   st.session_state.user, data_to_update.get('category', ''))
+    else:
+        try: repository.update_transaction(transaction_id, data_to_update)
+        except Exception as e: st.error(f"Erro ao atualizar transação: {e}"); return
+    if original_data is not None: track_budget_change(original_data, {**original_data, **data_to_update})
+    search_index.apply_write("transactions", transaction_id, {**(original_data or {}), **data_to_update})
+    st.session_state.editing_transaction = None
+    finish_row_action("transactions", transaction_id, {**(original_data or {}), **data_to_update}, original_data, optimistic)
+
+def update_payment_status_in_firestore(transaction_id, new_status, current_status=None, label="", row_data=None):
+    if not db: st.error("Conexão com o banco de dados não estabelecida."); return
+    optimistic = st.session_state.get('optimistic_mode') and current_status is not None
+    if optimistic:
+        write_queue.enqueue_update("transactions", transaction_id, {"status_pagamento": new_status},
+                                   {"status_pagamento": current_status}, st.session_state.user, label)
+    else:
+        try: repository.update_payment_status(transaction_id, new_status)
+        except Exception as e: st.error(f"Erro ao atualizar status do pagamento: {e}"); return
+    # O status não entra nos totais: com os dados da linha, só ela é redesenhada
+    finish_row_action("transactions", transaction_id, {**row_data, "status_pagamento": new_status} if row_data else None, row_data, optimistic)
 
 # --- Funções CRUD para Despesas da Moto ---
 def add_moto_transaction(user, date_obj, expense_type, description, amount, mileage, liters=None):
     if not db: st.error("Conexão com o banco de dados não estabelecida."); return
-    if not expense_type or not description or amount <= 0:
-        st.warning("Preencha todos os campos obrigatórios com valores válidos.")
-        return
     try:
-        timestamp_obj = datetime.datetime.combine(date_obj, datetime.datetime.min.time())
-        doc_ref = db.collection("moto_transactions").document()
-        data_to_save = {
-            "user": user, "date": timestamp_obj, "expense_type": expense_type,
-            "description": description.strip(), "amount": float(amount),
-            "mileage": int(mileage) if mileage else None,
-            "created_at": firestore.SERVER_TIMESTAMP
-        }
-        if expense_type == "Combustível" and liters is not None and liters > 0:
-            data_to_save["liters"] = float(liters)
-        
-        doc_ref.set(data_to_save)
-        st.success("Despesa da moto adicionada com sucesso!")
-    except Exception as e: st.error(f"Erro ao adicionar despesa da moto: {e}")
+        doc_id, data = repository.add_moto_transaction(user, date_obj, expense_type, description, amount, mileage, liters)
+        search_index.apply_write("moto_transactions", doc_id, data)
+    except ValidationError as e: st.warning(str(e)); return
+    except Exception as e: st.error(f"Erro ao adicionar despesa da moto: {e}"); return
+    rerun_with_feedback("Despesa da moto adicionada com sucesso!")
 
-def get_moto_transactions_df():
+def get_moto_transactions_df(reuse_snapshot=False):
     if not db: st.error("Conexão com o banco de dados não estabelecida."); return pd.DataFrame()
     try:
-        transactions_ref = db.collection("moto_transactions").order_by("date", direction=firestore.Query.DESCENDING).stream()
-        transactions_list = []
-        for trans_doc in transactions_ref:
-            data = trans_doc.to_dict()
-            data["id"] = trans_doc.id
-            if 'date' in data and isinstance(data['date'], datetime.datetime):
-                data['date'] = data['date'].date()
-            transactions_list.append(data)
-        
-        if not transactions_list:
-             return pd.DataFrame(columns=["id", "user", "date", "expense_type", "description", "amount", "mileage", "liters"])
-
-        df = pd.DataFrame(transactions_list)
-        
-        # **CORREÇÃO APLICADA AQUI**
-        # Garante que a coluna 'liters' existe, preenchendo com NA se estiver ausente (para dados antigos)
-        if 'liters' not in df.columns:
-            df['liters'] = pd.NA
-
-        if 'date' in df.columns: df['date'] = pd.to_datetime(df['date'])
-        if 'amount' in df.columns: df['amount'] = pd.to_numeric(df['amount'])
-        if 'mileage' in df.columns: df['mileage'] = pd.to_numeric(df['mileage'])
-        if 'liters' in df.columns: df['liters'] = pd.to_numeric(df['liters'])
-        return df
+        return finance_data.moto_transactions_frame(load_collection_rows("moto_transactions", reuse_snapshot))
+    except ReadBudgetExceeded as e: st.warning(f"{e} Tente novamente amanhã."); return pd.DataFrame()
     except Exception as e: st.error(f"Erro ao buscar despesas da moto: {e}"); return pd.DataFrame()
 
-def delete_moto_transaction_from_firestore(transaction_id):
+def delete_moto_transaction_from_firestore(transaction_id, label="", deleted_data=None):
     if not db: st.error("Conexão com o banco de dados não estabelecida."); return
-    try:
-        db.collection("moto_transactions").document(transaction_id).delete()
-        st.success("Despesa da moto excluída com sucesso!")
-        st.session_state.pending_delete_moto_id = None
-        if st.session_state.get('editing_moto_transaction', {}).get('id') == transaction_id:
-            st.session_state.editing_moto_transaction = None
-    except Exception as e: st.error(f"Erro ao excluir despesa da moto: {e}")
-    st.rerun()
+    optimistic = st.session_state.get('optimistic_mode')
+    if optimistic: write_queue.enqueue_delete("moto_transactions", transaction_id, st.session_state.user, label)
+    else:
+        try: repository.delete_moto_transaction(transaction_id)
+        except Exception as e: st.error(f"Erro ao excluir despesa da moto: {e}"); return
+    search_index.apply_write("moto_transactions", transaction_id)
+    st.session_state.pending_delete_moto_id = None
+    if (st.session_state.get('editing_moto_transaction') or {}).get('id') == transaction_id:
+        st.session_state.editing_moto_transaction = None
+    finish_row_action("moto_transactions", transaction_id, None, deleted_data, optimistic)
 
-def update_moto_transaction_in_firestore(transaction_id, data_to_update):
+def update_moto_transaction_in_firestore(transaction_id, data_to_update, original_data=None):
     if not db: st.error("Conexão com o banco de dados não estabelecida."); return
-    try:
-        data_to_update["updated_at"] = firestore.SERVER_TIMESTAMP
-        db.collection("moto_transactions").document(transaction_id).update(data_to_update)
-        st.success("Despesa da moto atualizada com sucesso!")
-        st.session_state.editing_moto_transaction = None
-    except Exception as e: st.error(f"Erro ao atualizar despesa da moto: {e}")
-    st.rerun()
+    optimistic = st.session_state.get('optimistic_mode') and original_data is not None
+    if optimistic:
+        write_queue.enqueue_update("moto_transactions", transaction_id, data_to_update, original_data,
+                                   st.session_state.user, data_to_update.get('description', ''))
+    else:
+        try: repository.update_moto_transaction(transaction_id, data_to_update)
+        except Exception as e: st.error(f"Erro ao atualizar despesa da moto: {e}"); return
+    search_index.apply_write("moto_transactions", transaction_id, {**(original_data or {}), **data_to_update})
+    st.session_state.editing_moto_transaction = None
+    finish_row_action("moto_transactions", transaction_id, {**(original_data or {}), **data_to_update}, original_data, optimistic)
 
 
 # --- Funções de Interface (Geral, Moto, Edição) ---
+# Cada linha das tabelas é um fragmento: pagar, editar ou confirmar exclusão redesenha só a linha.
+# A página inteira só é redesenhada quando a ação muda os totais (ver finish_row_action).
+def current_row_data(collection, row_data):
+    # Depois de uma ação na linha, o fragmento é repetido com os argumentos da última execução completa
+    return st.session_state.row_overrides.get((collection, row_data['id']), row_data)
+
+def rerun_row(other_rows_affected=False):
+    # Só uma linha por vez fica em edição ou confirmação; se outra linha estava, ela também precisa ser redesenhada
+    if other_rows_affected: st.rerun()
+    rerun_fragment()
+
+def row_records(df):
+    records = df.to_dict('records')
+    for record in records:
+        if isinstance(record.get('date'), pd.Timestamp): record['date'] = record['date'].date()
+    return records
+
 def display_edit_transaction_form():
     if not st.session_state.get('editing_transaction'): return
 
@@ -318,6 +368,7 @@ def display_edit_transaction_form():
     
     current_date_val = current_data.get('date')
     if isinstance(current_date_val, pd.Timestamp): current_date_val = current_date_val.date()
+    elif isinstance(current_date_val, datetime.datetime): current_date_val = current_date_val.date()
     elif isinstance(current_date_val, str):
         try: current_date_val = datetime.datetime.strptime(current_date_val.split(" ")[0], "%Y-%m-%d").date()
         except ValueError: current_date_val = datetime.date.today() 
@@ -325,7 +376,7 @@ def display_edit_transaction_form():
 
     with st.form(key=f"edit_form_{transaction_id}"):
         edited_date = st.date_input("Data", value=current_date_val, key=f"edit_date_{transaction_id}")
-        tipos = ["Receita", "Despesa", "Investimento"]
+        tipos = TRANSACTION_TYPES
         current_type_idx = tipos.index(current_data.get('type', "Despesa")) if current_data.get('type') in tipos else 1
         edited_type = st.selectbox("Tipo", tipos, index=current_type_idx, key=f"edit_type_{transaction_id}")
         edited_category = st.text_input("Categoria", value=current_data.get('category', ''), key=f"edit_category_{transaction_id}")
@@ -352,10 +403,10 @@ def display_edit_transaction_form():
                     data_to_update["status_pagamento"] = edited_payment_status
                 elif "status_pagamento" in data_to_update: 
                     del data_to_update["status_pagamento"]
-                update_transaction_in_firestore(transaction_id, data_to_update)
+                update_transaction_in_firestore(transaction_id, data_to_update, current_data)
         
         if cols[1].form_submit_button("Cancelar Edição", type="secondary"):
-            st.session_state.editing_transaction = None; st.rerun()
+            st.session_state.editing_transaction = None; rerun_row()
     st.markdown("---")
 
 def render_transaction_rows(df_transactions, list_id_prefix=""):
@@ -374,54 +425,64 @@ def render_transaction_rows(df_transactions, list_id_prefix=""):
     for col, field_name in zip(header_cols, fields):
         col.markdown(f"**{field_name}**")
 
-    for index, row in df_transactions.iterrows():
-        trans_id = row["id"]
-        row_data_for_edit = row.to_dict()
-        if isinstance(row_data_for_edit.get('date'), pd.Timestamp):
-            row_data_for_edit['date'] = row_data_for_edit['date'].date()
-        
-        can_edit_delete = row.get('user') == st.session_state.user
-        is_expense = row.get('type') == "Despesa"
-        payment_status = row.get('status_pagamento', "Pendente") if is_expense else ""
+    for row_data in row_records(df_transactions):
+        render_transaction_row(row_data, list_id_prefix)
+    st.markdown("---")
+
+@st.fragment
+def render_transaction_row(row_data, list_id_prefix):
+    row = current_row_data("transactions", row_data)
+    if row is None: return # Excluída; a página inteira já está sendo redesenhada
+    trans_id = row["id"]
+    row_data_for_edit = dict(row)
+
+    can_edit_delete = row.get('user') == st.session_state.user
+    is_expense = row.get('type') == "Despesa"
+    payment_status = row.get('status_pagamento', "Pendente") if is_expense else ""
+    editing_id = (st.session_state.get('editing_transaction') or {}).get('id')
+    pending_delete_id = st.session_state.get('pending_delete_id')
 
-        cols = st.columns((2, 2, 2, 3, 2, 2, 1, 1), gap="small") 
+    cols = st.columns((2, 2, 2, 3, 2, 2, 1, 1), gap="small") 
+    
+    cols[0].write(row['date'].strftime('%d/%m/%Y') if pd.notnull(row['date']) else 'N/A')
+    cols[1].write(row['type'])
+    cols[2].write(row['category'])
+    cols[3].write(row.get('description', '')[:25] + '...' if len(row.get('description', '')) > 25 else row.get('description', '')) 
+    cols[4].write(format_brazilian_currency(row['amount'])) 
+
+    status_col_content = cols[5]
+    if is_expense and can_edit_delete:
+        status_col_content.markdown(f"<div class='status-text'>Status: {payment_status}</div>", unsafe_allow_html=True)
+        button_label = "Pagar" if payment_status == "Pendente" else "Pendente" 
+        new_status_on_click = "Pago" if payment_status == "Pendente" else "Pendente"
+        if status_col_content.button(button_label, key=f"{list_id_prefix}_status_{trans_id}", help=f"Clique para marcar como {new_status_on_click}"):
+            update_payment_status_in_firestore(trans_id, new_status_on_click, payment_status, row['category'], row_data_for_edit)
+    elif is_expense:
+        status_col_content.write(payment_status)
+    else:
+        status_col_content.write("-") 
+
+    if can_edit_delete:
+        if cols[6].button("✏️", key=f"{list_id_prefix}_edit_{trans_id}", help="Editar"):
+            st.session_state.editing_transaction = {'id': trans_id, 'data': row_data_for_edit}
+            st.session_state.pending_delete_id = None
+            rerun_row(editing_id not in (None, trans_id) or pending_delete_id not in (None, trans_id))
         
-        cols[0].write(row['date'].strftime('%d/%m/%Y') if pd.notnull(row['date']) else 'N/A')
-        cols[1].write(row['type'])
-        cols[2].write(row['category'])
-        cols[3].write(row.get('description', '')[:25] + '...' if len(row.get('description', '')) > 25 else row.get('description', '')) 
-        cols[4].write(format_brazilian_currency(row['amount'])) 
-
-        status_col_content = cols[5]
-        if is_expense and can_edit_delete:
-            status_col_content.markdown(f"<div class='status-text'>Status: {payment_status}</div>", unsafe_allow_html=True)
-            button_label = "Pagar" if payment_status == "Pendente" else "Pendente" 
-            new_status_on_click = "Pago" if payment_status == "Pendente" else "Pendente"
-            if status_col_content.button(button_label, key=f"{list_id_prefix}_status_{trans_id}", help=f"Clique para marcar como {new_status_on_click}"):
-                update_payment_status_in_firestore(trans_id, new_status_on_click)
-        elif is_expense:
-            status_col_content.write(payment_status)
-        else:
-            status_col_content.write("-") 
-
-        if can_edit_delete:
-            if cols[6].button("✏️", key=f"{list_id_prefix}_edit_{trans_id}", help="Editar"):
-                st.session_state.editing_transaction = {'id': trans_id, 'data': row_data_for_edit}
-                st.session_state.pending_delete_id = None; st.rerun()
-            
-            if st.session_state.get('pending_delete_id') == trans_id:
-                confirm_cols = cols[7].columns([1,1])
-                if confirm_cols[0].button("✅", key=f"{list_id_prefix}_confirmdel_{trans_id}", help="Confirmar Exclusão"):
-                    delete_transaction_from_firestore(trans_id) 
-                if confirm_cols[1].button("❌", key=f"{list_id_prefix}_canceldel_{trans_id}", help="Cancelar Exclusão"):
-                    st.session_state.pending_delete_id = None; st.rerun()
-            else:
-                if cols[7].button("🗑️", key=f"{list_id_prefix}_delete_{trans_id}", help="Excluir"):
-                    st.session_state.pending_delete_id = trans_id
-                    st.session_state.editing_moto_transaction = None; st.rerun()
+        if pending_delete_id == trans_id:
+            confirm_cols = cols[7].columns([1,1])
+            if confirm_cols[0].button("✅", key=f"{list_id_prefix}_confirmdel_{trans_id}", help="Confirmar Exclusão"):
+                delete_transaction_from_firestore(trans_id, row['category'], row_data_for_edit) 
+            if confirm_cols[1].button("❌", key=f"{list_id_prefix}_canceldel_{trans_id}", help="Cancelar Exclusão"):
+                st.session_state.pending_delete_id = None; rerun_row()
         else:
-            cols[6].write(""); cols[7].write("") 
-    st.markdown("---")
+            if cols[7].button("🗑️", key=f"{list_id_prefix}_delete_{trans_id}", help="Excluir"):
+                st.session_state.pending_delete_id = trans_id
+                st.session_state.editing_transaction = None
+                rerun_row(pending_delete_id is not None or editing_id not in (None, trans_id))
+    else:
+        cols[6].write(""); cols[7].write("") 
+
+    if editing_id == trans_id: display_edit_transaction_form()
 
 # --- Funções de Interface para Despesas da Moto ---
 def display_edit_moto_transaction_form():
@@ -435,6 +496,7 @@ def display_edit_moto_transaction_form():
     
     current_date_val = current_data.get('date')
     if isinstance(current_date_val, pd.Timestamp): current_date_val = current_date_val.date()
+    elif isinstance(current_date_val, datetime.datetime): current_date_val = current_date_val.date()
     elif isinstance(current_date_val, str):
         try: current_date_val = datetime.datetime.strptime(current_date_val.split(" ")[0], "%Y-%m-%d").date()
         except ValueError: current_date_val = datetime.date.today() 
@@ -447,10 +509,10 @@ def display_edit_moto_transaction_form():
         edited_description = st.text_area("Descrição", value=current_data.get('description', ''), key=f"edit_moto_desc_{transaction_id}")
         edited_amount = st.number_input("Valor (R$)", value=float(current_data.get('amount', 0.0)),
                                         min_value=0.01, format="%.2f", step=0.01, key=f"edit_moto_amount_{transaction_id}")
-        edited_mileage = st.number_input("Quilometragem (KM)", value=int(current_data.get('mileage', 0) or 0),
+        edited_mileage = st.number_input("Quilometragem (KM)", value=int(current_data['mileage']) if pd.notnull(current_data.get('mileage')) else 0,
                                          min_value=0, step=100, key=f"edit_moto_mileage_{transaction_id}")
         
-        edited_liters = current_data.get('liters', 0.0)
+        edited_liters = current_data.get('liters') if pd.notnull(current_data.get('liters')) else 0.0
         if edited_type == "Combustível":
             edited_liters = st.number_input("Litros Abastecidos", value=float(edited_liters or 0.0), min_value=0.0, format="%.2f", step=0.01, key=f"edit_moto_liters_{transaction_id}")
 
@@ -468,10 +530,10 @@ def display_edit_moto_transaction_form():
                 elif "liters" in data_to_update:
                     del data_to_update["liters"]
                 
-                update_moto_transaction_in_firestore(transaction_id, data_to_update)
+                update_moto_transaction_in_firestore(transaction_id, data_to_update, current_data)
         
         if cols[1].form_submit_button("Cancelar Edição", type="secondary"):
-            st.session_state.editing_moto_transaction = None; st.rerun()
+            st.session_state.editing_moto_transaction = None; rerun_row()
     st.markdown("---")
 
 def render_moto_transaction_rows(df_moto_transactions):
@@ -487,41 +549,51 @@ def render_moto_transaction_rows(df_moto_transactions):
     for col, field_name in zip(header_cols, fields):
         col.markdown(f"**{field_name}**")
 
-    for index, row in df_moto_transactions.iterrows():
-        trans_id = row["id"]
-        row_data_for_edit = row.to_dict()
-        if isinstance(row_data_for_edit.get('date'), pd.Timestamp):
-            row_data_for_edit['date'] = row_data_for_edit['date'].date()
-        
-        can_edit_delete = row.get('user') == st.session_state.user
+    for row_data in row_records(df_moto_transactions):
+        render_moto_transaction_row(row_data)
+    st.markdown("---")
+
+@st.fragment
+def render_moto_transaction_row(row_data):
+    row = current_row_data("moto_transactions", row_data)
+    if row is None: return # Excluída; a página inteira já está sendo redesenhada
+    trans_id = row["id"]
+    row_data_for_edit = dict(row)
+
+    can_edit_delete = row.get('user') == st.session_state.user
+    editing_id = (st.session_state.get('editing_moto_transaction') or {}).get('id')
+    pending_delete_id = st.session_state.get('pending_delete_moto_id')
 
-        cols = st.columns((2, 3, 4, 2, 2, 2, 1, 1), gap="small") 
+    cols = st.columns((2, 3, 4, 2, 2, 2, 1, 1), gap="small") 
+    
+    cols[0].write(row['date'].strftime('%d/%m/%Y') if pd.notnull(row['date']) else 'N/A')
+    cols[1].write(row['expense_type'])
+    cols[2].write(row.get('description', ''))
+    cols[3].write(format_brazilian_currency(row['amount'])) 
+    cols[4].write(f"{row['mileage']:,}".replace(",", ".") if pd.notnull(row['mileage']) and row['mileage'] > 0 else "-")
+    cols[5].write(f"{row['liters']:.2f} L" if pd.notnull(row.get('liters')) and row.get('liters') > 0 else "-")
+
+    if can_edit_delete:
+        if cols[6].button("✏️", key=f"moto_edit_{trans_id}", help="Editar"):
+            st.session_state.editing_moto_transaction = {'id': trans_id, 'data': row_data_for_edit}
+            st.session_state.pending_delete_moto_id = None
+            rerun_row(editing_id not in (None, trans_id) or pending_delete_id not in (None, trans_id))
         
-        cols[0].write(row['date'].strftime('%d/%m/%Y') if pd.notnull(row['date']) else 'N/A')
-        cols[1].write(row['expense_type'])
-        cols[2].write(row.get('description', ''))
-        cols[3].write(format_brazilian_currency(row['amount'])) 
-        cols[4].write(f"{row['mileage']:,}".replace(",", ".") if pd.notnull(row['mileage']) and row['mileage'] > 0 else "-")
-        cols[5].write(f"{row['liters']:.2f} L" if pd.notnull(row.get('liters')) and row.get('liters') > 0 else "-")
-
-        if can_edit_delete:
-            if cols[6].button("✏️", key=f"moto_edit_{trans_id}", help="Editar"):
-                st.session_state.editing_moto_transaction = {'id': trans_id, 'data': row_data_for_edit}
-                st.session_state.pending_delete_moto_id = None; st.rerun()
-            
-            if st.session_state.get('pending_delete_moto_id') == trans_id:
-                confirm_cols = cols[7].columns([1,1])
-                if confirm_cols[0].button("✅", key=f"moto_confirmdel_{trans_id}", help="Confirmar Exclusão"):
-                    delete_moto_transaction_from_firestore(trans_id) 
-                if confirm_cols[1].button("❌", key=f"moto_canceldel_{trans_id}", help="Cancelar Exclusão"):
-                    st.session_state.pending_delete_moto_id = None; st.rerun()
-            else:
-                if cols[7].button("🗑️", key=f"moto_delete_{trans_id}", help="Excluir"):
-                    st.session_state.pending_delete_moto_id = trans_id
-                    st.session_state.editing_moto_transaction = None; st.rerun()
+        if pending_delete_id == trans_id:
+            confirm_cols = cols[7].columns([1,1])
+            if confirm_cols[0].button("✅", key=f"moto_confirmdel_{trans_id}", help="Confirmar Exclusão"):
+                delete_moto_transaction_from_firestore(trans_id, row.get('description', ''), row_data_for_edit) 
+            if confirm_cols[1].button("❌", key=f"moto_canceldel_{trans_id}", help="Cancelar Exclusão"):
+                st.session_state.pending_delete_moto_id = None; rerun_row()
         else:
-            cols[6].write(""); cols[7].write("") 
-    st.markdown("---")
+            if cols[7].button("🗑️", key=f"moto_delete_{trans_id}", help="Excluir"):
+                st.session_state.pending_delete_moto_id = trans_id
+                st.session_state.editing_moto_transaction = None
+                rerun_row(pending_delete_id is not None or editing_id not in (None, trans_id))
+    else:
+        cols[6].write(""); cols[7].write("") 
+
+    if editing_id == trans_id: display_edit_moto_transaction_form()
 
 
 # --- Páginas da Aplicação ---
@@ -534,14 +606,26 @@ def page_login():
 
 def page_log_transaction():
     st.header(f"Olá, {st.session_state.user}! Registre uma nova transação:")
-    display_edit_transaction_form() 
+    transaction_entry_form()
+
+    st.markdown("---"); st.subheader("Últimas Transações Lançadas por Você:")
+    all_trans_df = get_transactions_df()
+    if not all_trans_df.empty:
+        user_recent_df = all_trans_df[all_trans_df['user'] == st.session_state.user].sort_values(by="date", ascending=False).head(10)
+        render_transaction_rows(user_recent_df, "recent")
+    else: st.info("Nenhuma transação registrada no banco de dados.")
+
+@st.fragment
+def transaction_entry_form():
+    # Trocar entre Único/Parcelado ou o tipo redesenha só o formulário, sem reler o banco
+    show_entry_form_feedback()
     st.radio("Tipo de Lançamento:", ("Único", "Parcelado"), horizontal=True, key="transaction_mode_selection_key")
 
     with st.form("transaction_form", clear_on_submit=True):
         col1, col2 = st.columns(2)
         with col1:
             transaction_date_val = st.date_input("Data da Transação (ou 1ª Parcela)", datetime.date.today(), key="form_trans_date")
-            transaction_type_val = st.selectbox("Tipo", ["Receita", "Despesa", "Investimento"], key="form_trans_type")
+            transaction_type_val = st.selectbox("Tipo", TRANSACTION_TYPES, key="form_trans_type")
         with col2:
             common_categories = {"Receita": ["Salário", "Freelance", "Rendimentos", "Outros"],
                                  "Despesa": ["Moradia", "Alimentação", "Transporte", "Saúde", "Lazer", "Educação", "Vestuário", "Contas", "Outros"],
@@ -571,51 +655,51 @@ def page_log_transaction():
                             category_val, description_val, amount_val,
                             is_recurring_flag_val, num_installments_val,
                             payment_status_val if transaction_type_val == "Despesa" else None) 
-    
-    st.markdown("---"); st.subheader("Últimas Transações Lançadas por Você:")
-    all_trans_df = get_transactions_df()
-    if not all_trans_df.empty:
-        user_recent_df = all_trans_df[all_trans_df['user'] == st.session_state.user].sort_values(by="date", ascending=False).head(10)
-        render_transaction_rows(user_recent_df, "recent")
-    else: st.info("Nenhuma transação registrada no banco de dados.")
+
+def display_long_range_charts(df_history, title_prefix=""):
+    if df_history.empty: return
+    st.subheader(f"{title_prefix}Evolução de Longo Prazo")
+    widget_key = f"{title_prefix.lower().replace(' ', '_').replace('-', '')}_long_range"
+    range_label = st.radio("Período:", list(LONG_RANGE_OPTIONS), index=2, horizontal=True, key=widget_key)
+
+    # A janela escolhida é reduzida a um número fixo de pontos: quanto maior o período, menor a resolução
+    balance = charts.daily_balance_series(df_history)
+    # A janela termina hoje: parcelas futuras já lançadas não empurram o período para frente
+    end = min(balance.index.max(), max(pd.Timestamp.today().normalize(), balance.index.min()))
+    months = LONG_RANGE_OPTIONS[range_label]
+    start = balance.index.min() if months is None else max(balance.index.min(), end - pd.DateOffset(months=months))
+    balance_window = charts.window(balance, start, end)
+    balance_points = charts.downsample(balance_window)
+    fig_balance = charts.scattergl_figure({"Saldo acumulado": balance_points}, "Saldo Acumulado Diário", {"Saldo acumulado": "seagreen"})
+    st.plotly_chart(fig_balance, use_container_width=True)
+    st.caption(f"{len(balance_points)} de {len(balance_window)} dias exibidos")
+
+    monthly_series = {
+        transaction_type: charts.downsample(charts.window(charts.monthly_totals(df_history, transaction_type), start, end))
+        for transaction_type in ("Receita", "Despesa")
+    }
+    fig_monthly = charts.scattergl_figure(monthly_series, "Receitas vs. Despesas Mensais (Longo Prazo)",
+                                          {"Receita": "blue", "Despesa": "red"}, mode="lines+markers")
+    st.plotly_chart(fig_monthly, use_container_width=True)
 
 def display_summary_charts_and_data(df_period, df_full_history_for_user_or_couple, selected_month_internal, title_prefix=""):
     if df_period.empty:
         st.info(f"{title_prefix}Nenhuma transação encontrada para {format_month_year_for_display(selected_month_internal)}.")
     else:
-        receitas = df_period[df_period['type'] == 'Receita']['amount'].sum()
-        despesas_total = df_period[df_period['type'] == 'Despesa']['amount'].sum()
-        investimentos_periodo = df_period[df_period['type'] == 'Investimento']['amount'].sum() 
-        saldo = receitas - (despesas_total + investimentos_periodo) 
+        summary = finance_data.month_summary(df_period)
+        receitas, despesas_total, saldo = summary['receitas'], summary['despesas'], summary['saldo']
 
         st.subheader(f"{title_prefix}Resumo de {format_month_year_for_display(selected_month_internal)}")
         col1, col2, col3, col4 = st.columns(4)
         col1.metric("Receitas", format_brazilian_currency(receitas))
         col2.metric("Despesas", format_brazilian_currency(despesas_total)) 
-        col3.metric("Investimentos", format_brazilian_currency(investimentos_periodo)) 
+        col3.metric("Investimentos", format_brazilian_currency(summary['investimentos'])) 
         col4.metric("Saldo Final", format_brazilian_currency(saldo), delta_color=("inverse" if saldo < 0 else "normal"))
         st.markdown("---")
         st.subheader(f"{title_prefix}Composição Receita vs. Despesa ({format_month_year_for_display(selected_month_internal)})")
-        chart_values, chart_names, chart_colors, chart_title = [], [], [], "Situação Financeira do Mês"
+        chart_values, chart_names, chart_colors, chart_title = finance_data.composition_breakdown(receitas, despesas_total)
         if receitas == 0 and despesas_total == 0:
             st.info(f"{title_prefix}Sem dados de receita ou despesa para este período.")
-        elif receitas == 0 and despesas_total > 0:
-            chart_values, chart_names, chart_colors = [despesas_total], ['Despesas (Sem Receita)'], ['crimson']
-            chart_title = "Situação Financeira: Déficit (Sem Receita)"
-        elif receitas > 0:
-            if despesas_total <= receitas:
-                chart_values = [despesas_total, receitas - despesas_total]
-                chart_names = ['Despesas Cobertas', 'Saldo Positivo da Receita']
-                chart_colors = ['sandybrown', 'lightgreen'] 
-                chart_title = "Receita vs. Despesa: Saldo Positivo"
-                if despesas_total == 0 and (receitas - despesas_total) == 0: pass
-                elif despesas_total == 0 : chart_values, chart_names, chart_colors = [receitas - despesas_total], ['Saldo Positivo da Receita'], ['lightgreen']
-                elif (receitas - despesas_total) == 0: chart_values, chart_names, chart_colors = [despesas_total], ['Despesas (Cobriram 100% da Receita)'], ['sandybrown']
-            else: 
-                chart_values = [receitas, despesas_total - receitas]
-                chart_names = ['Receita (Coberta)', 'Despesa Excedente (Déficit)']
-                chart_colors = ['lightcoral', 'crimson'] 
-                chart_title = "Receita vs. Despesa: Déficit"
         if chart_values and sum(chart_values) > 0: 
             fig_comp = px.pie(values=chart_values, names=chart_names, title=chart_title, color_discrete_sequence=chart_colors)
             fig_comp.update_traces(textposition='inside', textinfo='percent+label+value', hole=.3 if len(chart_values)>1 else 0)
@@ -625,38 +709,25 @@ def display_summary_charts_and_data(df_period, df_full_history_for_user_or_coupl
 
     if not df_full_history_for_user_or_couple.empty and selected_month_internal:
         st.subheader(f"{title_prefix}Histórico Mensal (12 Meses até {format_month_year_for_display(selected_month_internal)})")
-        df_history_copy = df_full_history_for_user_or_couple.copy()
-        if 'date' in df_history_copy.columns:
-             df_history_copy['month_year'] = pd.to_datetime(df_history_copy['date']).dt.strftime('%Y-%m')
-        all_available_months_sorted_chronologically = sorted(list(df_history_copy['month_year'].unique()))
         try:
-            end_index = all_available_months_sorted_chronologically.index(selected_month_internal)
-            start_index = max(0, end_index - 11) 
-            months_for_history_chart = all_available_months_sorted_chronologically[start_index : end_index + 1]
-            if months_for_history_chart:
-                history_df_for_chart = df_history_copy[df_history_copy['month_year'].isin(months_for_history_chart)]
-                history_df_filtered = history_df_for_chart[history_df_for_chart['type'].isin(['Receita', 'Despesa'])]
-                if not history_df_filtered.empty:
-                    monthly_summary = history_df_filtered.groupby(['month_year', 'type'])['amount'].sum().unstack(fill_value=0).reset_index()
-                    if 'Receita' not in monthly_summary.columns: monthly_summary['Receita'] = 0
-                    if 'Despesa' not in monthly_summary.columns: monthly_summary['Despesa'] = 0
-                    monthly_summary = monthly_summary.sort_values(by='month_year') 
-                    
-                    color_map = {"Receita": "blue", "Despesa": "red"}
-
-                    fig_line_history = px.line(monthly_summary, x='month_year', y=['Receita', 'Despesa'],
-                                               title='Receitas vs. Despesas Mensais',
-                                               labels={'month_year': 'Mês/Ano', 'value': 'Valor (R$)', 'variable': 'Tipo'}, 
-                                               markers=True,
-                                               color_discrete_map=color_map) 
-                    fig_line_history.update_layout(yaxis_title='Valor (R$)', xaxis_title='Mês/Ano')
-                    st.plotly_chart(fig_line_history, use_container_width=True)
-                else: st.info(f"{title_prefix}Não há dados de Receita ou Despesa no período de 12 meses até {format_month_year_for_display(selected_month_internal)}.")
-            else: st.info(f"{title_prefix}Não há dados suficientes para o histórico de 12 meses até {format_month_year_for_display(selected_month_internal)}.")
+            monthly_summary = finance_data.monthly_history(df_full_history_for_user_or_couple, selected_month_internal)
+            if not monthly_summary.empty:
+                color_map = {"Receita": "blue", "Despesa": "red"}
+
+                fig_line_history = px.line(monthly_summary, x='month_year', y=['Receita', 'Despesa'],
+                                           title='Receitas vs. Despesas Mensais',
+                                           labels={'month_year': 'Mês/Ano', 'value': 'Valor (R$)', 'variable': 'Tipo'}, 
+                                           markers=True,
+                                           color_discrete_map=color_map) 
+                fig_line_history.update_layout(yaxis_title='Valor (R$)', xaxis_title='Mês/Ano')
+                st.plotly_chart(fig_line_history, use_container_width=True)
+            else: st.info(f"{title_prefix}Não há dados de Receita ou Despesa no período de 12 meses até {format_month_year_for_display(selected_month_internal)}.")
         except ValueError: st.info(f"{title_prefix}Mês selecionado ({format_month_year_for_display(selected_month_internal)}) não encontrado nos dados históricos para o gráfico de linha.")
     elif not df_full_history_for_user_or_couple.empty: st.info(f"{title_prefix}Selecione um mês para ver o histórico de 12 meses correspondente.")
     else: st.info(f"{title_prefix}Nenhuma transação no histórico para exibir gráfico de linha.")
     st.markdown("---")
+    display_long_range_charts(df_full_history_for_user_or_couple, title_prefix)
+    st.markdown("---")
     st.subheader(f"{title_prefix}Detalhes das Transações de {format_month_year_for_display(selected_month_internal) if selected_month_internal else 'Período Não Selecionado'}")
     if not df_period.empty: 
         render_transaction_rows(df_period.sort_values(by="date", ascending=False), f"{title_prefix.lower().replace(' ', '_').replace('-', '')}_summary_period")
@@ -665,20 +736,16 @@ def display_summary_charts_and_data(df_period, df_full_history_for_user_or_coupl
 
 def page_my_summary():
     st.header(f"Meu Resumo Financeiro - {st.session_state.user}")
-    display_edit_transaction_form() 
     selectbox_key = "my_summary_month_select" 
     current_menu_page = st.session_state.get("main_menu_selection")
     df_all_transactions_system = get_transactions_df() 
     if df_all_transactions_system.empty: st.info("Nenhuma transação no banco de dados."); return
     df_user_full_history = df_all_transactions_system[df_all_transactions_system['user'] == st.session_state.user].copy()
     if df_user_full_history.empty: st.info("Você ainda não registrou transações."); return
-    if 'date' in df_user_full_history.columns: df_user_full_history['month_year'] = pd.to_datetime(df_user_full_history['date']).dt.strftime('%Y-%m')
+    df_user_full_history = finance_data.with_month_year(df_user_full_history)
     current_calendar_month_internal = datetime.date.today().strftime("%Y-%m")
-    available_months_internal = sorted(list(df_user_full_history['month_year'].unique()), reverse=False) 
-    display_options, internal_to_display_map, display_to_internal_map = [], {}, {} 
-    all_possible_months_internal = set(available_months_internal)
-    all_possible_months_internal.add(current_calendar_month_internal) 
-    for month_internal in sorted(list(all_possible_months_internal), reverse=True): 
+    display_options, internal_to_display_map, display_to_internal_map = [], {}, {}
+    for month_internal in finance_data.month_options(df_user_full_history, current_calendar_month_internal):
         formatted_month = format_month_year_for_display(month_internal)
         display_options.append(formatted_month)
         internal_to_display_map[month_internal] = formatted_month
@@ -692,6 +759,7 @@ def page_my_summary():
     selected_month_display = st.selectbox("Selecione o Mês/Ano para o resumo detalhado:", options=display_options, key=selectbox_key)
     selected_month_internal = display_to_internal_map.get(selected_month_display)
     if selected_month_internal:
+        display_budget_badges([st.session_state.user], selected_month_internal)
         df_period_user = df_user_full_history[df_user_full_history['month_year'] == selected_month_internal]
         display_summary_charts_and_data(df_period_user, df_user_full_history, selected_month_internal, "Meu ")
     elif display_options : 
@@ -703,18 +771,14 @@ def page_my_summary():
 
 def page_couple_summary():
     st.header("Resumo Financeiro do Casal")
-    display_edit_transaction_form() 
     selectbox_key = "couple_summary_month_select"
     current_menu_page = st.session_state.get("main_menu_selection")
     df_all_transactions_system = get_transactions_df() 
     if df_all_transactions_system.empty: st.info("Nenhuma transação registrada no banco de dados."); return
-    if 'date' in df_all_transactions_system.columns: df_all_transactions_system['month_year'] = pd.to_datetime(df_all_transactions_system['date']).dt.strftime('%Y-%m')
+    df_all_transactions_system = finance_data.with_month_year(df_all_transactions_system)
     current_calendar_month_internal = datetime.date.today().strftime("%Y-%m")
-    available_months_internal = sorted(list(df_all_transactions_system['month_year'].unique()), reverse=False)
     display_options, internal_to_display_map, display_to_internal_map = [], {}, {}
-    all_possible_months_internal = set(available_months_internal)
-    all_possible_months_internal.add(current_calendar_month_internal)
-    for month_internal in sorted(list(all_possible_months_internal), reverse=True):
+    for month_internal in finance_data.month_options(df_all_transactions_system, current_calendar_month_internal):
         formatted_month = format_month_year_for_display(month_internal)
         display_options.append(formatted_month)
         internal_to_display_map[month_internal] = formatted_month
@@ -728,6 +792,7 @@ def page_couple_summary():
     selected_month_display = st.selectbox("Selecione o Mês/Ano para o resumo detalhado:", options=display_options, key=selectbox_key)
     selected_month_internal = display_to_internal_map.get(selected_month_display)
     if selected_month_internal:
+        display_budget_badges(list(USERS), selected_month_internal)
         df_period_couple = df_all_transactions_system[df_all_transactions_system['month_year'] == selected_month_internal]
         display_summary_charts_and_data(df_period_couple, df_all_transactions_system, selected_month_internal, "Casal - ")
     elif display_options:
@@ -737,41 +802,101 @@ def page_couple_summary():
             df_period_couple = df_all_transactions_system[df_all_transactions_system['month_year'] == selected_month_internal_fallback]
             display_summary_charts_and_data(df_period_couple, df_all_transactions_system, selected_month_internal_fallback, "Casal - ")
 
+# --- Página de Orçamentos ---
+def page_budgets():
+    st.header("💰 Orçamentos Mensais")
+    st.caption("Defina um limite mensal por categoria. Os resumos mostram um alerta quando o gasto do mês chega a 80% do limite ou o ultrapassa.")
+    with st.form("budget_form", clear_on_submit=True):
+        col1, col2, col3 = st.columns(3)
+        budget_type = col1.selectbox("Tipo", BUDGET_TYPES, key="budget_form_type")
+        budget_category = col2.text_input("Categoria", key="budget_form_category", placeholder="Ex.: Alimentação")
+        budget_limit = col3.number_input("Limite mensal (R$)", min_value=0.01, format="%.2f", step=10.0, key="budget_form_limit")
+        if st.form_submit_button("Salvar Orçamento"):
+            if not budget_category.strip(): st.warning("Informe a categoria do orçamento.")
+            else:
+                try:
+                    budget_tracker.set_budget(st.session_state.user, budget_type, budget_category, budget_limit)
+                    st.success(f"Orçamento de '{budget_category.strip().capitalize()}' salvo!")
+                except Exception as e: st.error(f"Erro ao salvar orçamento: {e}")
+
+    # No primeiro uso os totais correntes são montados a partir do histórico
+    if budget_tracker.needs_rebuild: get_transactions_df()
+    current_month_internal = datetime.date.today().strftime("%Y-%m")
+    st.subheader(f"Situação de {format_month_year_for_display(current_month_internal)}")
+    budgets_list = budget_tracker.budgets_for(st.session_state.user, current_month_internal)
+    if not budgets_list: st.info("Nenhum orçamento definido ainda."); return
+    for budget in budgets_list:
+        ratio = budget['total'] / budget['limit']
+        cols = st.columns((3, 6, 2, 1), gap="small")
+        cols[0].write(f"**{budget['category']}** ({budget['type']})")
+        cols[1].progress(min(ratio, 1.0), text=f"{format_brazilian_currency(budget['total'])} de {format_brazilian_currency(budget['limit'])} ({ratio:.0%})")
+        if budget['level'] == LEVEL_EXCEEDED: cols[2].markdown(":red-badge[🚨 Excedido]")
+        elif budget['level']: cols[2].markdown(":orange-badge[⚠️ Atenção]")
+        else: cols[2].markdown(":green-badge[✅ OK]")
+        if cols[3].button("🗑️", key=f"budget_delete_{budget['type']}_{budget['category']}", help="Excluir orçamento"):
+            try: budget_tracker.delete_budget(st.session_state.user, budget['type'], budget['category'])
+            except Exception as e: st.error(f"Erro ao excluir orçamento: {e}")
+            st.rerun()
+
+# --- Página de Busca ---
+def paginate_df(df, page_key, page_size=SEARCH_PAGE_SIZE):
+    total_pages = max(1, math.ceil(len(df) / page_size))
+    if st.session_state.get(page_key, total_pages + 1) > total_pages: st.session_state[page_key] = 1
+    if total_pages == 1: return df
+    page = st.number_input(f"Página (de {total_pages})", min_value=1, max_value=total_pages, step=1, key=page_key)
+    start = (page - 1) * page_size
+    st.caption(f"Mostrando {start + 1}–{min(start + page_size, len(df))} de {len(df)}")
+    return df.iloc[start:start + page_size]
+
+def page_search():
+    st.header("🔎 Buscar Lançamentos")
+
+    query = st.text_input("Buscar por descrição, categoria ou tipo", key="search_query", placeholder="Ex.: pneu, mercado, aluguel")
+    col1, col2, col3, col4 = st.columns(4)
+    min_amount = col1.number_input("Valor mínimo (R$)", min_value=0.0, value=None, format="%.2f", key="search_min_amount")
+    max_amount = col2.number_input("Valor máximo (R$)", min_value=0.0, value=None, format="%.2f", key="search_max_amount")
+    start_date = col3.date_input("De", value=None, format="DD/MM/YYYY", key="search_start_date")
+    end_date = col4.date_input("Até", value=None, format="DD/MM/YYYY", key="search_end_date")
+    scope = st.radio("Onde buscar:", ("Tudo", "Transações", "Moto"), horizontal=True, key="search_scope")
+
+    if not query and min_amount is None and max_amount is None and start_date is None and end_date is None:
+        st.info("Digite um termo ou escolha um filtro para buscar."); return
+
+    collections = {"Tudo": ("transactions", "moto_transactions"), "Transações": ("transactions",), "Moto": ("moto_transactions",)}[scope]
+    # Digitar na busca não relê as coleções: o índice e o cache do gateway já recebem as escritas do app
+    df_trans = get_transactions_df(reuse_snapshot=True) if "transactions" in collections else pd.DataFrame()
+    df_moto = get_moto_transactions_df(reuse_snapshot=True) if "moto_transactions" in collections else pd.DataFrame()
+
+    search_start = time.perf_counter()
+    results = search_index.search(query, collections, min_amount, max_amount, start_date, end_date)
+    elapsed_ms = (time.perf_counter() - search_start) * 1000
+    st.caption(f"{len(results)} resultado(s) em {elapsed_ms:.1f} ms")
+
+    # Nova busca volta para a primeira página
+    search_signature = (query, min_amount, max_amount, start_date, end_date, scope)
+    if st.session_state.get("last_search_signature") != search_signature:
+        st.session_state.last_search_signature = search_signature
+        st.session_state.search_page_transactions = 1
+        st.session_state.search_page_moto = 1
+
+    trans_ids = [doc_id for collection, doc_id in results if collection == "transactions"]
+    moto_ids = [doc_id for collection, doc_id in results if collection == "moto_transactions"]
+    if not trans_ids and not moto_ids: st.info("Nenhum lançamento encontrado."); return
+    if trans_ids and not df_trans.empty:
+        st.subheader(f"Transações ({len(trans_ids)})")
+        df_found = df_trans[df_trans['id'].isin(trans_ids)].sort_values(by="date", ascending=False)
+        render_transaction_rows(paginate_df(df_found, "search_page_transactions"), "search")
+    if moto_ids and not df_moto.empty:
+        st.subheader(f"Moto ({len(moto_ids)})")
+        df_found = df_moto[df_moto['id'].isin(moto_ids)].sort_values(by="date", ascending=False)
+        render_moto_transaction_rows(paginate_df(df_found, "search_page_moto"))
+
 # --- Nova Página: Despesas da Moto ---
 def page_moto_expenses():
     st.header("🏍️ Controle de Despesas da Moto")
-    display_edit_moto_transaction_form()
 
     st.subheader("Adicionar Novo Lançamento")
-    
-    # Seletor do tipo de despesa fora do formulário para UI dinâmica
-    moto_expense_type = st.selectbox("Tipo de Despesa", MOTO_EXPENSE_TYPES, key="moto_expense_type_key")
-
-    with st.form("moto_transaction_form", clear_on_submit=True):
-        col1, col2 = st.columns(2)
-        with col1:
-            moto_date = st.date_input("Data do Serviço", datetime.date.today(), key="moto_date")
-            moto_amount = st.number_input("Valor (R$)", min_value=0.01, format="%.2f", step=0.01, key="moto_amount")
-        with col2:
-            moto_mileage = st.number_input("Quilometragem (KM)", min_value=0, step=100, key="moto_mileage", help="Opcional: KM no momento do serviço")
-            moto_liters = 0.0
-            # Campo de litros aparece condicionalmente
-            if st.session_state.moto_expense_type_key == "Combustível":
-                moto_liters = st.number_input("Litros Abastecidos", min_value=0.0, format="%.2f", step=0.01, key="moto_liters")
-
-        moto_description = st.text_area("Descrição (Ex: Troca de óleo, Pneu traseiro)", key="moto_desc")
-        
-        submitted = st.form_submit_button("Adicionar Despesa da Moto")
-        if submitted:
-            add_moto_transaction(
-                st.session_state.user,
-                moto_date,
-                st.session_state.moto_expense_type_key, # Usa o valor do seletor externo
-                moto_description,
-                moto_amount,
-                moto_mileage,
-                moto_liters if st.session_state.moto_expense_type_key == "Combustível" else None
-            )
+    moto_entry_form()
 
     st.markdown("---")
     st.subheader("Histórico de Manutenções e Despesas")
@@ -779,30 +904,8 @@ def page_moto_expenses():
     df_moto = get_moto_transactions_df()
     
     if not df_moto.empty:
-        total_cost = df_moto['amount'].sum()
-        
-        df_with_mileage = df_moto.dropna(subset=['mileage'])
-        cost_per_km = 0
-        km_per_liter = 0
-        
-        if not df_with_mileage.empty and df_with_mileage['mileage'].nunique() > 1:
-            # Filtra apenas para despesas de combustível com quilometragem e litros
-            df_fuel_for_calc = df_with_mileage[(df_with_mileage['expense_type'] == 'Combustível') & (df_with_mileage['liters'].notna()) & (df_with_mileage['liters'] > 0)]
-            total_fuel_cost = df_fuel_for_calc['amount'].sum()
-            total_liters = df_fuel_for_calc['liters'].sum()
-            
-            # A distância percorrida é calculada com base em todas as entradas de KM
-            max_km = df_with_mileage['mileage'].max()
-            min_km = df_with_mileage['mileage'].min()
-            distance_traveled = max_km - min_km
-            
-            if distance_traveled > 0:
-                # Custo de combustível por KM
-                if total_fuel_cost > 0:
-                    cost_per_km = total_fuel_cost / distance_traveled
-                # Consumo em KM por Litro
-                if total_liters > 0:
-                    km_per_liter = distance_traveled / total_liters
+        stats = finance_data.moto_stats(df_moto)
+        total_cost, cost_per_km, km_per_liter = stats['total_cost'], stats['cost_per_km'], stats['km_per_liter']
 
         col1, col2, col3 = st.columns(3)
         col1.metric("Custo Total com a Moto", format_brazilian_currency(total_cost))
@@ -817,8 +920,7 @@ def page_moto_expenses():
             col3.info("Adicione lançamentos de combustível com KM e Litros para calcular o KM/L.")
 
         st.subheader("Gastos por Tipo")
-        costs_by_type = df_moto.groupby('expense_type')['amount'].sum().reset_index()
-        fig_moto_costs = px.bar(costs_by_type, x='expense_type', y='amount', 
+        fig_moto_costs = px.bar(stats['costs_by_type'], x='expense_type', y='amount', 
                                 title="Distribuição de Custos da Moto",
                                 labels={'expense_type': 'Tipo de Despesa', 'amount': 'Valor Gasto (R$)'},
                                 text_auto=True)
@@ -828,22 +930,66 @@ def page_moto_expenses():
 
     render_moto_transaction_rows(df_moto)
 
+@st.fragment
+def moto_entry_form():
+    # Trocar o tipo de despesa (que mostra ou esconde os litros) redesenha só o formulário
+    show_entry_form_feedback()
+    # Seletor do tipo de despesa fora do formulário para UI dinâmica
+    moto_expense_type = st.selectbox("Tipo de Despesa", MOTO_EXPENSE_TYPES, key="moto_expense_type_key")
+
+    with st.form("moto_transaction_form", clear_on_submit=True):
+        col1, col2 = st.columns(2)
+        with col1:
+            moto_date = st.date_input("Data do Serviço", datetime.date.today(), key="moto_date")
+            moto_amount = st.number_input("Valor (R$)", min_value=0.01, format="%.2f", step=0.01, key="moto_amount")
+        with col2:
+            moto_mileage = st.number_input("Quilometragem (KM)", min_value=0, step=100, key="moto_mileage", help="Opcional: KM no momento do serviço")
+            moto_liters = 0.0
+            # Campo de litros aparece condicionalmente
+            if st.session_state.moto_expense_type_key == "Combustível":
+                moto_liters = st.number_input("Litros Abastecidos", min_value=0.0, format="%.2f", step=0.01, key="moto_liters")
+
+        moto_description = st.text_area("Descrição (Ex: Troca de óleo, Pneu traseiro)", key="moto_desc")
+        
+        submitted = st.form_submit_button("Adicionar Despesa da Moto")
+        if submitted:
+            add_moto_transaction(
+                st.session_state.user,
+                moto_date,
+                st.session_state.moto_expense_type_key, # Usa o valor do seletor externo
+                moto_description,
+                moto_amount,
+                moto_mileage,
+                moto_liters if st.session_state.moto_expense_type_key == "Combustível" else None
+            )
+
 
 # --- Lógica Principal da Aplicação ---
 def main_app():
+    st.session_state.row_overrides = {} # Execução completa: as linhas voltam a vir dos dados lidos
     st.sidebar.title(f"Bem-vindo(a), {st.session_state.user}!")
     menu_options = {
         "🏠 Lançar Transação": page_log_transaction,
         "📊 Meu Resumo": page_my_summary,
         "💑 Resumo do Casal": page_couple_summary,
-        "🏍️ Despesas da Moto": page_moto_expenses
+        "🏍️ Despesas da Moto": page_moto_expenses,
+        "🔎 Buscar": page_search,
+        "💰 Orçamentos": page_budgets
     }
     selection = st.sidebar.radio("Menu", list(menu_options.keys()), key="main_menu_selection")
     st.sidebar.markdown("---")
+    st.sidebar.toggle("⚡ Modo otimista", key="optimistic_mode",
+                      help="Aplica edições, exclusões e mudanças de status na hora e sincroniza com o banco em segundo plano.")
+    pending_writes = write_queue.pending_count(st.session_state.user)
+    if pending_writes: st.sidebar.caption(f"⏳ {pending_writes} alteração(ões) aguardando sincronização")
+    for failure_message in write_queue.pop_failures(st.session_state.user):
+        st.error(failure_message)
     if st.sidebar.button("Logout"): logout_user()
     page_function = menu_options[selection]
     page_function() 
     st.session_state.last_main_menu_selection = selection 
+    st.session_state.reuse_snapshot = False
+    while st.session_state.budget_toasts: st.toast(st.session_state.budget_toasts.pop(0))
     st.sidebar.markdown("---"); st.sidebar.info("Dados armazenados no Firebase Firestore.")
 
 # --- Ponto de Entrada ---
@@ -0,0 +1,203 @@
+"""Camada de acesso ao Firestore compartilhada entre as sessões do app.
+
+- Consultas idênticas em andamento são coalescidas em uma só (single-flight).
+- Erros transitórios são repetidos com backoff exponencial e jitter.
+- Um orçamento diário de leituras de documentos é respeitado; quando acaba, a
+  última resposta conhecida de cada consulta é servida no lugar do banco.
+"""
+import datetime
+import random
+import threading
+import time
+from concurrent.futures import Future
+from typing import NamedTuple
+from zoneinfo import ZoneInfo
+
+from google.api_core import exceptions as google_exceptions
+from google.cloud.firestore_v1.base_query import BaseQuery, FieldFilter
+
+# A cota gratuita do Firestore zera à meia-noite do horário do Pacífico
+QUOTA_TIMEZONE = ZoneInfo("America/Los_Angeles")
+DEFAULT_DAILY_READ_BUDGET = 45000  # Abaixo das 50 mil leituras/dia da cota gratuita
+
+TRANSIENT_ERRORS = (
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.DeadlineExceeded,
+    google_exceptions.InternalServerError,
+    google_exceptions.Aborted,
+    ConnectionError,
+)
+
+
+def sort_value(value):
+    # Chave de ordenação que aceita datas com e sem fuso (o app grava datas sem fuso)
+    if isinstance(value, datetime.datetime): value = value.replace(tzinfo=None)
+    return (value is not None, value)
+
+
+def _as_stored(fields):
+    # O Firestore guarda datas sem fuso como UTC e as devolve com fuso: o cache recebe a mesma forma de uma leitura
+    return {field: value.replace(tzinfo=datetime.timezone.utc) if isinstance(value, datetime.datetime) and value.tzinfo is None else value
+            for field, value in fields.items()}
+
+
+class ReadBudgetExceeded(Exception):
+    pass
+
+
+class QueryResult(NamedTuple):
+    rows: list  # [(doc_id, dict)]
+    fetched_at: datetime.datetime
+    stale: bool = False
+
+
+class FirestoreGateway:
+    def __init__(self, db, daily_read_budget=DEFAULT_DAILY_READ_BUDGET, max_attempts=4, base_delay=0.2, max_delay=4.0):
+        self.db = db
+        self.daily_read_budget = daily_read_budget
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._lock = threading.Lock()
+        self._in_flight = {}
+        self._last_results = {}
+        self._budget_day = self._today()
+        self._reads_today = 0
+        self._quota_exhausted = False
+        self.stats = {"queries": 0, "coalesced": 0, "retries": 0, "stale_served": 0}
+
+    # --- Orçamento de leituras ---
+    @staticmethod
+    def _today():
+        return datetime.datetime.now(QUOTA_TIMEZONE).date()
+
+    def _roll_budget_day(self):
+        today = self._today()
+        if today != self._budget_day:
+            self._budget_day, self._reads_today, self._quota_exhausted = today, 0, False
+
+    def count_reads(self, num_docs):
+        with self._lock:
+            self._roll_budget_day()
+            self._reads_today += max(int(num_docs), 1)  # Consultas vazias também cobram 1 leitura
+
+    def reads_today(self):
+        with self._lock:
+            self._roll_budget_day()
+            return self._reads_today
+
+    def budget_remaining(self):
+        if self.daily_read_budget is None: return None
+        return max(self.daily_read_budget - self.reads_today(), 0)
+
+    def _over_budget(self, estimated_reads):
+        with self._lock:
+            self._roll_budget_day()
+            if self._quota_exhausted: return True
+            if self.daily_read_budget is None: return False
+            return self._reads_today + max(estimated_reads, 1) > self.daily_read_budget
+
+    # --- Retentativas ---
+    def _with_retries(self, operation):
+        for attempt in range(self.max_attempts):
+            try:
+                return operation()
+            except TRANSIENT_ERRORS:
+                if attempt == self.max_attempts - 1: raise
+                with self._lock: self.stats["retries"] += 1
+                # Backoff exponencial com "full jitter" para não sincronizar sessões concorrentes
+                time.sleep(random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt)))
+
+    def run_write(self, operation):
+        # Só use com escritas idempotentes (set em referência já criada, update, delete)
+        return self._with_retries(operation)
+
+    # --- Consultas ---
+    def get(self, collection, doc_id):
+        # Leitura de um único documento, sem coalescência nem cache; None se não existir
+        snapshot = self._with_retries(lambda: self.db.collection(collection).document(doc_id).get())
+        self.count_reads(1)
+        return snapshot.to_dict() if snapshot.exists else None
+
+    def _build_query(self, collection, order_by, direction, filters):
+        query = self.db.collection(collection)
+        for field_path, op_string, value in filters:
+            query = query.where(filter=FieldFilter(field_path, op_string, value))
+        if order_by:
+            query = query.order_by(order_by, direction=direction) if direction else query.order_by(order_by)
+        return query
+
+    def _serve_stale(self, key, error):
+        cached = self._last_results.get(key)
+        if cached is None: raise error
+        with self._lock: self.stats["stale_served"] += 1
+        return cached._replace(stale=True)
+
+    def _load(self, key, collection, order_by, direction, filters):
+        cached = self._last_results.get(key)
+        if self._over_budget(len(cached.rows) if cached else 0):
+            return self._serve_stale(key, ReadBudgetExceeded("Orçamento diário de leituras do Firestore esgotado."))
+        try:
+            query = self._build_query(collection, order_by, direction, filters)
+            rows = self._with_retries(lambda: [(doc.id, doc.to_dict()) for doc in query.stream()])
+        except google_exceptions.ResourceExhausted:
+            with self._lock: self._quota_exhausted = True
+            return self._serve_stale(key, ReadBudgetExceeded("Cota de leituras do Firestore esgotada."))
+        except TRANSIENT_ERRORS as e:
+            return self._serve_stale(key, e)
+        self.count_reads(len(rows))
+        result = QueryResult(rows, datetime.datetime.now())
+        self._last_results[key] = result
+        return result
+
+    def stream(self, collection, order_by=None, direction=None, filters=(), max_age=None):
+        key = (collection, order_by, direction, tuple(filters))
+        cached = self._last_results.get(key)
+        if max_age is not None and cached is not None and (datetime.datetime.now() - cached.fetched_at).total_seconds() <= max_age:
+            # Resultado recente o bastante: evita reler a coleção inteira
+            return cached._replace(rows=[(doc_id, dict(data)) for doc_id, data in cached.rows])
+        with self._lock:
+            self.stats["queries"] += 1
+            future = self._in_flight.get(key)
+            is_leader = future is None
+            if is_leader:
+                future = Future()
+                self._in_flight[key] = future
+            else:
+                self.stats["coalesced"] += 1
+        if is_leader:
+            try:
+                future.set_result(self._load(key, collection, order_by, direction, tuple(filters)))
+            except BaseException as e:
+                future.set_exception(e)
+            finally:
+                with self._lock: self._in_flight.pop(key, None)
+        result = future.result()
+        # Cada chamador recebe cópias, pois as linhas são compartilhadas entre sessões
+        return result._replace(rows=[(doc_id, dict(data)) for doc_id, data in result.rows])
+
+    # --- Cache ---
+    def record_write(self, collection, doc_id, fields=None, replace=False):
+        # Aplica uma escrita já confirmada às últimas respostas, para que reusá-las (max_age) não a desfaça.
+        # fields=None: exclusão; replace=True: o documento passa a ser exatamente fields (set)
+        self.record_writes(collection, {doc_id: fields}, replace)
+
+    def record_writes(self, collection, changes, replace=False):
+        # changes: {id: campos, ou None para exclusão}
+        with self._lock:
+            for key, cached in list(self._last_results.items()):
+                if key[0] != collection: continue
+                if key[3]:
+                    # A escrita pode mudar quais documentos entram numa consulta filtrada: ela é relida
+                    del self._last_results[key]
+                    continue
+                remaining, rows = dict(changes), []
+                for row_id, data in cached.rows:
+                    if row_id not in remaining: rows.append((row_id, data)); continue
+                    fields = remaining.pop(row_id)
+                    if fields is not None: rows.append((row_id, _as_stored(fields) if replace else {**data, **_as_stored(fields)}))
+                if replace: rows.extend((doc_id, _as_stored(fields)) for doc_id, fields in remaining.items() if fields is not None)
+                order_by, direction = key[1], key[2]
+                if order_by and any(fields and order_by in fields for fields in changes.values()):
+                    rows.sort(key=lambda row: sort_value(row[1].get(order_by)), reverse=direction == BaseQuery.DESCENDING)
+                self._last_results[key] = cached._replace(rows=rows)
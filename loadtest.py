@@ -0,0 +1,467 @@
+"""Teste de carga do financeiro.py com sessões simultâneas.
+
+Executa o app via streamlit.testing.v1.AppTest contra um Firestore em memória
+e simula N sessões fazendo login, trocando de página, adicionando transações,
+buscando e clicando em "Pagar". Ao final mostra latência p50/p95 dos reruns,
+leituras e escritas no Firestore por sessão e memória do processo.
+
+Uso:
+    python loadtest.py --sessions 6 --actions 20 --seed-rows 2000
+"""
+import argparse
+import ast
+import contextlib
+import datetime
+import json
+import os
+import random
+import resource
+import threading
+import time
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+import firebase_admin
+import streamlit as st
+from firebase_admin import firestore
+from google.api_core import exceptions as google_exceptions
+from streamlit.runtime import Runtime
+from streamlit.runtime.secrets import Secrets
+from streamlit.testing.v1 import AppTest
+from streamlit.testing.v1.util import patch_config_options
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "financeiro.py")
+SESSION_STATE_TAG = "_loadtest_session"
+LOGIN_CREDENTIALS = [("Luiz", "1517"), ("Iasmin", "1516")]
+MENU_PAGES = ["🏠 Lançar Transação", "📊 Meu Resumo", "💑 Resumo do Casal", "🏍️ Despesas da Moto", "🔎 Buscar", "💰 Orçamentos"]
+
+
+# --- Firestore em memória ---
+def _current_session():
+    # As chamadas ao banco acontecem na thread do script; a sessão é identificada pelo session_state
+    try:
+        return st.session_state.get(SESSION_STATE_TAG, "background")
+    except Exception:
+        return "background"
+
+
+def _stored_value(value):
+    # Como no Firestore real: datas sem fuso são gravadas como UTC e voltam com fuso (também dentro de listas e mapas)
+    if isinstance(value, datetime.datetime) and value.tzinfo is None: return value.replace(tzinfo=datetime.timezone.utc)
+    if isinstance(value, list): return [_stored_value(item) for item in value]
+    if isinstance(value, dict): return {key: _stored_value(item) for key, item in value.items()}
+    return value
+
+
+def _apply_field_transforms(current, data):
+    result = dict(current)
+    for field, value in data.items():
+        if value is firestore.SERVER_TIMESTAMP:
+            result[field] = datetime.datetime.now(datetime.timezone.utc)
+        elif isinstance(value, firestore.Increment):
+            result[field] = (result.get(field) or 0) + value.value
+        else:
+            result[field] = _stored_value(value)
+    return result
+
+
+class _DocumentSnapshot:
+    def __init__(self, reference, data):
+        self.reference = reference
+        self.id = reference.id
+        self._data = data
+        self.exists = data is not None
+
+    def to_dict(self):
+        return dict(self._data) if self._data is not None else None
+
+
+class _DocumentReference:
+    def __init__(self, store, collection, doc_id):
+        self._store = store
+        self._collection = collection
+        self.id = doc_id
+
+    def get(self):
+        with self._store.operation(reads=1):
+            data = self._store.collections[self._collection].get(self.id)
+            return _DocumentSnapshot(self, dict(data) if data is not None else None)
+
+    def set(self, data, merge=False):
+        with self._store.operation(writes=1):
+            docs = self._store.collections[self._collection]
+            docs[self.id] = _apply_field_transforms(docs.get(self.id, {}) if merge else {}, data)
+
+    def update(self, data):
+        with self._store.operation(writes=1):
+            docs = self._store.collections[self._collection]
+            if self.id not in docs:
+                raise google_exceptions.NotFound(f"Documento inexistente: {self._collection}/{self.id}")
+            docs[self.id] = _apply_field_transforms(docs[self.id], data)
+
+    def delete(self, option=None):
+        with self._store.operation(writes=1):
+            docs = self._store.collections[self._collection]
+            if option and option.get("exists") and self.id not in docs:
+                raise google_exceptions.NotFound(f"Documento inexistente: {self._collection}/{self.id}")
+            docs.pop(self.id, None)
+
+
+_FILTER_OPERATORS = {
+    "==": lambda a, b: a == b,
+    "!=": lambda a, b: a != b,
+    "<": lambda a, b: a is not None and a < b,
+    "<=": lambda a, b: a is not None and a <= b,
+    ">": lambda a, b: a is not None and a > b,
+    ">=": lambda a, b: a is not None and a >= b,
+    "in": lambda a, b: a in b,
+    "not-in": lambda a, b: a not in b,
+}
+
+
+class _Query:
+    def __init__(self, store, collection, filters=(), orders=(), limit_count=None):
+        self._store = store
+        self._collection = collection
+        self._filters = tuple(filters)
+        self._orders = tuple(orders)
+        self._limit = limit_count
+
+    def where(self, field_path=None, op_string=None, value=None, *, filter=None):
+        if filter is not None:
+            field_path, op_string, value = filter.field_path, filter.op_string, filter.value
+        return _Query(self._store, self._collection, self._filters + ((field_path, op_string, value),), self._orders, self._limit)
+
+    def order_by(self, field_path, direction=firestore.Query.ASCENDING):
+        return _Query(self._store, self._collection, self._filters, self._orders + ((field_path, direction),), self._limit)
+
+    def limit(self, count):
+        return _Query(self._store, self._collection, self._filters, self._orders, count)
+
+    def stream(self):
+        with self._store.operation():
+            items = [(doc_id, dict(data)) for doc_id, data in self._store.collections[self._collection].items()]
+        for field, op, value in self._filters:
+            items = [item for item in items if _FILTER_OPERATORS[op](item[1].get(field), value)]
+        for field, direction in reversed(self._orders):
+            # Assim como no Firestore, documentos sem o campo de ordenação ficam de fora
+            items = [item for item in items if item[1].get(field) is not None]
+            items.sort(key=lambda item: item[1][field], reverse=direction == firestore.Query.DESCENDING)
+        if self._limit is not None:
+            items = items[:self._limit]
+        self._store.count(reads=max(len(items), 1))  # Consultas vazias também cobram 1 leitura
+        for doc_id, data in items:
+            yield _DocumentSnapshot(_DocumentReference(self._store, self._collection, doc_id), data)
+
+    def get(self):
+        return list(self.stream())
+
+
+class _CollectionReference(_Query):
+    def __init__(self, store, collection):
+        super().__init__(store, collection)
+
+    def document(self, doc_id=None):
+        return _DocumentReference(self._store, self._collection, doc_id or uuid.uuid4().hex[:20])
+
+
+class _WriteBatch:
+    def __init__(self, store):
+        self._store = store
+        self._operations = []
+
+    def set(self, reference, data, merge=False):
+        self._operations.append(lambda: reference.set(data, merge=merge))
+
+    def update(self, reference, data):
+        self._operations.append(lambda: reference.update(data))
+
+    def delete(self, reference):
+        self._operations.append(reference.delete)
+
+    def commit(self):
+        for operation in self._operations:
+            operation()
+        self._operations = []
+
+
+class InMemoryFirestore:
+    def __init__(self, latency_ms=0.0, fail_rate=0.0):
+        self.collections = defaultdict(dict)
+        self.latency = latency_ms / 1000.0
+        self.fail_rate = fail_rate
+        self.failures = 0
+        self.reads = defaultdict(int)
+        self.writes = defaultdict(int)
+        self._lock = threading.RLock()
+
+    def collection(self, name):
+        return _CollectionReference(self, name)
+
+    def batch(self):
+        return _WriteBatch(self)
+
+    def write_option(self, **kwargs):
+        return kwargs  # Só a pré-condição exists=True é simulada
+
+    def count(self, reads=0, writes=0):
+        session = _current_session()
+        with self._lock:
+            self.reads[session] += reads
+            self.writes[session] += writes
+
+    @contextlib.contextmanager
+    def operation(self, reads=0, writes=0):
+        if self.latency:
+            time.sleep(self.latency)  # Simula a ida e volta da rede
+        if self.fail_rate and random.random() < self.fail_rate:
+            with self._lock: self.failures += 1
+            raise google_exceptions.ServiceUnavailable("Falha transitória simulada")
+        with self._lock:
+            self.count(reads, writes)
+            yield
+
+
+def seed_transactions(db, num_rows, rng):
+    today = datetime.date.today()
+    categories = {"Receita": ["Salário", "Freelance"], "Despesa": ["Moradia", "Alimentação", "Transporte", "Lazer"],
+                  "Investimento": ["Renda fixa"]}
+    for _ in range(num_rows):
+        user = rng.choice(LOGIN_CREDENTIALS)[0]
+        trans_type = rng.choices(list(categories), weights=[2, 7, 1])[0]
+        date_obj = today - datetime.timedelta(days=rng.randint(0, 3 * 365))
+        data = {
+            "user": user, "date": datetime.datetime.combine(date_obj, datetime.time(tzinfo=datetime.timezone.utc)),
+            "type": trans_type, "category": rng.choice(categories[trans_type]),
+            "description": f"Carga {rng.randint(1, 9999)}", "amount": round(rng.uniform(10, 3000), 2),
+            "month_year": date_obj.strftime("%Y-%m"), "created_at": datetime.datetime.now(datetime.timezone.utc),
+        }
+        if trans_type == "Despesa":
+            data["status_pagamento"] = rng.choice(["Pago", "Pendente"])
+        db.collections["transactions"][uuid.uuid4().hex[:20]] = data
+    for _ in range(num_rows // 10):
+        date_obj = today - datetime.timedelta(days=rng.randint(0, 3 * 365))
+        db.collections["moto_transactions"][uuid.uuid4().hex[:20]] = {
+            "user": rng.choice(LOGIN_CREDENTIALS)[0], "date": datetime.datetime.combine(date_obj, datetime.time(tzinfo=datetime.timezone.utc)),
+            "expense_type": "Combustível", "description": "Abastecimento", "amount": round(rng.uniform(20, 80), 2),
+            "mileage": rng.randint(1000, 40000), "liters": round(rng.uniform(3, 12), 2),
+        }
+
+
+# --- Sessões simuladas ---
+class SimulatedSession:
+    def __init__(self, session_id, credentials, num_actions, rng, timeout):
+        self.session_id = session_id
+        self.username, self.password = credentials
+        self.num_actions = num_actions
+        self.rng = rng
+        self.timeout = timeout
+        self.latencies = defaultdict(list)
+        self.errors = []
+
+    def _run(self, action, at):
+        start = time.perf_counter()
+        at.run(timeout=self.timeout)
+        self.latencies[action].append(time.perf_counter() - start)
+        for exc in at.exception:
+            self.errors.append(f"{action}: {exc.value}")
+
+    def _click(self, at, label, action):
+        buttons = [b for b in at.button if b.label == label]
+        if not buttons:
+            return False
+        self.rng.choice(buttons).click()
+        self._run(action, at)
+        return True
+
+    def _switch_page(self, at, page):
+        at.radio(key="main_menu_selection").set_value(page)
+        self._run("troca_pagina", at)
+
+    def _add_transaction(self, at):
+        if at.radio(key="main_menu_selection").value != MENU_PAGES[0]:
+            self._switch_page(at, MENU_PAGES[0])
+        at.selectbox(key="form_trans_type").set_value("Despesa")
+        at.text_input(key="form_trans_category").input(self.rng.choice(["Alimentação", "Lazer", "Transporte"]))
+        at.text_area(key="form_trans_desc").input(f"Sessão {self.session_id}")
+        at.number_input(key="form_trans_amount").set_value(round(self.rng.uniform(5, 500), 2))
+        self._click(at, "Adicionar Transação", "adicionar")
+
+    def _search(self, at):
+        if at.radio(key="main_menu_selection").value != MENU_PAGES[4]:
+            self._switch_page(at, MENU_PAGES[4])
+        at.text_input(key="search_query").input(self.rng.choice(["alim", "carga 1", "moradia", "sessão"]))
+        self._run("buscar", at)
+
+    def _pay(self, at):
+        if not self._click(at, "Pagar", "pagar"):
+            self._switch_page(at, MENU_PAGES[1])
+            self._click(at, "Pagar", "pagar")
+
+    def run(self, start_barrier):
+        at = AppTest.from_file(APP_PATH, default_timeout=self.timeout)
+        at.session_state[SESSION_STATE_TAG] = self.session_id
+        start_barrier.wait()
+        self._run("login_pagina", at)
+        at.text_input(key="login_username").input(self.username)
+        at.text_input(key="login_password").input(self.password)
+        self._click(at, "Entrar", "login")
+        actions = [lambda: self._switch_page(at, self.rng.choice(MENU_PAGES)), lambda: self._add_transaction(at),
+                   lambda: self._pay(at), lambda: self._search(at)]
+        for _ in range(self.num_actions):
+            try:
+                self.rng.choices(actions, weights=[5, 2, 3, 1])[0]()
+            except (KeyError, IndexError) as e:
+                # Widget esperado não apareceu (ex.: rerun terminou em erro); registra e segue
+                self.errors.append(f"widget ausente: {e}")
+        return self
+
+
+# --- Relatório ---
+def _percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100.0 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def _current_rss_mb():
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024
+    except (OSError, ValueError):
+        return float("nan")
+
+
+def build_report(sessions, db, wall_time, rss_before_mb):
+    all_latencies = [lat for session in sessions for values in session.latencies.values() for lat in values]
+    by_action = defaultdict(list)
+    for session in sessions:
+        for action, values in session.latencies.items():
+            by_action[action].extend(values)
+    return {
+        "sessions": len(sessions),
+        "wall_time_s": round(wall_time, 3),
+        "reruns": len(all_latencies),
+        "latency_ms": {"p50": round(_percentile(all_latencies, 50) * 1000, 1), "p95": round(_percentile(all_latencies, 95) * 1000, 1)},
+        "latency_ms_by_action": {
+            action: {"n": len(values), "p50": round(_percentile(values, 50) * 1000, 1), "p95": round(_percentile(values, 95) * 1000, 1)}
+            for action, values in sorted(by_action.items())
+        },
+        "firestore_per_session": {
+            str(session_id): {"reads": db.reads.get(session_id, 0), "writes": db.writes.get(session_id, 0)}
+            for session_id in sorted(set(db.reads) | set(db.writes), key=str)
+        },
+        "firestore_injected_failures": db.failures,
+        "memory_mb": {
+            "rss_before": round(rss_before_mb, 1),
+            "rss_after": round(_current_rss_mb(), 1),
+            "peak_rss": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        },
+        "errors": [error for session in sessions for error in session.errors],
+    }
+
+
+def print_report(report):
+    print(f"Sessões: {report['sessions']} | Reruns: {report['reruns']} | Tempo total: {report['wall_time_s']:.2f}s")
+    print(f"Latência do rerun: p50 {report['latency_ms']['p50']} ms | p95 {report['latency_ms']['p95']} ms")
+    for action, stats in report["latency_ms_by_action"].items():
+        print(f"  {action:<14} n={stats['n']:<5} p50 {stats['p50']:>8} ms  p95 {stats['p95']:>8} ms")
+    print("Firestore (leituras/escritas de documentos):")
+    for session_id, ops in report["firestore_per_session"].items():
+        print(f"  sessão {session_id:<12} leituras {ops['reads']:>8}  escritas {ops['writes']:>6}")
+    if report["firestore_injected_failures"]:
+        print(f"  falhas transitórias injetadas: {report['firestore_injected_failures']}")
+    memory = report["memory_mb"]
+    print(f"Memória: RSS antes {memory['rss_before']} MB | depois {memory['rss_after']} MB | pico {memory['peak_rss']} MB")
+    if report["errors"]:
+        print(f"Erros ({len(report['errors'])}):")
+        for error in report["errors"][:20]:
+            print(f"  {error}")
+
+
+# O AppTest foi feito para testes sequenciais. Para rodar várias instâncias em threads:
+# - o ast.parse do CPython não é seguro entre threads ("AST constructor recursion depth mismatch");
+# - cada run instala e depois zera o Runtime global, derrubando os runs das outras sessões;
+# - cada run liga e depois desliga a opção global.appTest, e os widgets das outras sessões deixam de ser registrados.
+_ast_parse = ast.parse
+_ast_parse_lock = threading.Lock()
+_last_runtime = [None]
+
+
+def _serialized_ast_parse(*args, **kwargs):
+    with _ast_parse_lock:
+        return _ast_parse(*args, **kwargs)
+
+
+def _shared_runtime_instance(cls):
+    if cls._instance is not None:
+        _last_runtime[0] = cls._instance
+    if _last_runtime[0] is None:
+        raise RuntimeError("Runtime hasn't been created!")
+    return cls._instance or _last_runtime[0]
+
+
+def _shared_runtime_exists(cls):
+    return cls._instance is not None or _last_runtime[0] is not None
+
+
+def run_load_test(num_sessions, num_actions, seed_rows, latency_ms, seed, timeout, fail_rate=0.0, read_budget=None):
+    rng = random.Random(seed)
+    db = InMemoryFirestore(latency_ms=latency_ms, fail_rate=fail_rate)
+    seed_transactions(db, seed_rows, rng)
+    st.cache_resource.clear()
+    st.cache_data.clear()
+    # O Firebase é substituído pelo banco em memória; a credencial só precisa existir.
+    # Os secrets são instalados uma vez para todas as sessões (o AppTest os troca a cada run).
+    secrets = Secrets()
+    secrets._secrets = {"FIREBASE_SERVICE_ACCOUNT_JSON": "{}", "WRITE_BEHIND_QUEUE_PATH": ":memory:"}
+    if read_budget is not None:
+        secrets._secrets["FIRESTORE_DAILY_READ_BUDGET"] = read_budget
+    sessions = [
+        SimulatedSession(i, LOGIN_CREDENTIALS[i % len(LOGIN_CREDENTIALS)], num_actions, random.Random(rng.random()), timeout)
+        for i in range(num_sessions)
+    ]
+    start_barrier = threading.Barrier(num_sessions)
+    rss_before_mb = _current_rss_mb()
+    with mock.patch.dict(firebase_admin._apps, {"[DEFAULT]": object()}), \
+         mock.patch.object(firestore, "client", lambda app=None: db), \
+         mock.patch.object(st, "secrets", secrets), \
+         mock.patch.object(ast, "parse", _serialized_ast_parse), \
+         mock.patch.object(Runtime, "instance", classmethod(_shared_runtime_instance)), \
+         mock.patch.object(Runtime, "exists", classmethod(_shared_runtime_exists)), \
+         patch_config_options({"global.appTest": True}):
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=num_sessions) as executor:
+            futures = [executor.submit(session.run, start_barrier) for session in sessions]
+            for future in futures:
+                future.result()
+        wall_time = time.perf_counter() - start
+    return build_report(sessions, db, wall_time, rss_before_mb)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Teste de carga do financeiro.py com sessões simultâneas (AppTest + Firestore em memória).")
+    parser.add_argument("--sessions", type=int, default=4, help="Número de sessões simultâneas")
+    parser.add_argument("--actions", type=int, default=15, help="Ações por sessão após o login")
+    parser.add_argument("--seed-rows", type=int, default=1000, help="Transações pré-carregadas no banco em memória")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Latência simulada por chamada ao Firestore")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="Fração de chamadas ao Firestore que falham com erro transitório")
+    parser.add_argument("--read-budget", type=int, help="Orçamento diário de leituras repassado ao app via secrets")
+    parser.add_argument("--seed", type=int, default=42, help="Semente do gerador aleatório")
+    parser.add_argument("--timeout", type=float, default=120.0, help="Tempo máximo por rerun (s)")
+    parser.add_argument("--json", help="Salva o relatório em JSON neste caminho")
+    args = parser.parse_args()
+
+    report = run_load_test(args.sessions, args.actions, args.seed_rows, args.latency_ms, args.seed, args.timeout, args.fail_rate, args.read_budget)
+    print_report(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+"""Gera os relatórios mensais (HTML ou PDF) sem o Streamlit.
+
+Pensado para rodar por cron no fim do mês, por exemplo:
+
+    59 23 28-31 * * [ "$(date -d tomorrow +\\%d)" = "01" ] && python reports.py --credentials conta.json
+
+Os dados são lidos uma vez do Firestore; cada relatório (um por usuário e um do
+casal, por mês) é montado num processo separado.
+
+Uso:
+    python reports.py                              # mês corrente, todos os usuários e o casal
+    python reports.py --month 2025-05 --month 2025-06 --format pdf --output-dir relatorios
+"""
+import argparse
+import datetime
+import html
+import os
+import re
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+import plotly.express as px
+
+import finance_data
+from finance_data import FinanceRepository, connect_firestore, format_currency_manual, format_month_year_for_display
+from firestore_access import FirestoreGateway
+from search_index import normalize_text
+
+try:
+    from weasyprint import HTML as WeasyHTML  # Opcional: só para --format pdf
+except ImportError:
+    WeasyHTML = None
+
+COUPLE_SUBJECT = "Casal"
+TRANSACTION_TABLE_COLUMNS = [("date", "Data"), ("user", "Usuário"), ("type", "Tipo"), ("category", "Categoria"),
+                             ("description", "Descrição"), ("amount", "Valor (R$)"), ("status_pagamento", "Status Pag.")]
+MOTO_TABLE_COLUMNS = [("date", "Data"), ("expense_type", "Tipo"), ("description", "Descrição"), ("amount", "Valor (R$)"),
+                      ("mileage", "KM"), ("liters", "Litros")]
+PAGE_STYLE = """
+body { font-family: sans-serif; margin: 2rem; color: #222; }
+h1 { margin-bottom: 0; } h2 { margin-top: 2rem; border-bottom: 1px solid #ddd; }
+.metrics { display: flex; gap: 1rem; } .metric { border: 1px solid #ddd; border-radius: 6px; padding: 0.5rem 1rem; }
+.metric span { display: block; font-size: 0.8rem; color: #666; } .negative { color: crimson; }
+table { border-collapse: collapse; width: 100%; font-size: 0.85rem; } th, td { border-bottom: 1px solid #eee; padding: 4px 6px; text-align: left; }
+"""
+
+
+# --- Leitura ---
+def load_frames(repository):
+    df_transactions = finance_data.with_month_year(finance_data.transactions_frame(repository.rows("transactions").rows))
+    df_moto = finance_data.moto_transactions_frame(repository.rows("moto_transactions").rows)
+    return df_transactions, df_moto
+
+
+# --- Montagem do relatório (roda nos processos filhos) ---
+def _cell(column, value):
+    if value is None or pd.isna(value): return "-"
+    if column == "date": return value.strftime('%d/%m/%Y')
+    if column == "amount": return format_currency_manual(value)
+    if column == "mileage": return f"{int(value):,}".replace(",", ".") if value > 0 else "-"
+    if column == "liters": return f"{value:.2f} L" if value > 0 else "-"
+    return html.escape(str(value))
+
+def _table(df, columns):
+    if df.empty: return "<p>Nenhum lançamento.</p>"
+    header = "".join(f"<th>{label}</th>" for _, label in columns)
+    rows = []
+    for _, row in df.sort_values(by="date").iterrows():
+        rows.append("<tr>" + "".join(f"<td>{_cell(column, row.get(column))}</td>" for column, _ in columns) + "</tr>")
+    return f"<table><tr>{header}</tr>{''.join(rows)}</table>"
+
+def _metric(label, value):
+    css_class = " negative" if value < 0 else ""
+    return f"<div class='metric{css_class}'><span>{label}</span>{format_currency_manual(value)}</div>"
+
+def _figure(fig, with_charts):
+    # O PDF não executa JavaScript: os gráficos ficam só no HTML
+    return fig.to_html(full_html=False, include_plotlyjs="cdn") if with_charts else ""
+
+def render_report_html(subject, month_year, df_history, df_moto=None, with_charts=True):
+    df_period = df_history[df_history['month_year'] == month_year]
+    summary = finance_data.month_summary(df_period)
+    month_label = format_month_year_for_display(month_year)
+    sections = [f"<h1>Relatório de {month_label}</h1><p>{html.escape(subject)} — gerado em {datetime.datetime.now().strftime('%d/%m/%Y %H:%M')}</p>",
+                "<h2>Resumo</h2><div class='metrics'>" + _metric("Receitas", summary['receitas']) + _metric("Despesas", summary['despesas'])
+                + _metric("Investimentos", summary['investimentos']) + _metric("Saldo Final", summary['saldo']) + "</div>"]
+
+    chart_values, chart_names, chart_colors, chart_title = finance_data.composition_breakdown(summary['receitas'], summary['despesas'])
+    if chart_values and sum(chart_values) > 0:
+        composition = "".join(f"<tr><td>{name}</td><td>{format_currency_manual(value)}</td></tr>" for name, value in zip(chart_names, chart_values))
+        sections.append(f"<h2>{chart_title}</h2><table>{composition}</table>")
+        fig_comp = px.pie(values=chart_values, names=chart_names, color_discrete_sequence=chart_colors)
+        fig_comp.update_traces(textposition='inside', textinfo='percent+label+value', hole=.3 if len(chart_values) > 1 else 0)
+        sections.append(_figure(fig_comp, with_charts))
+
+    if month_year in set(df_history['month_year']):
+        monthly_summary = finance_data.monthly_history(df_history, month_year)
+        if not monthly_summary.empty:
+            history = "".join(f"<tr><td>{format_month_year_for_display(row['month_year'])}</td><td>{format_currency_manual(row['Receita'])}</td>"
+                              f"<td>{format_currency_manual(row['Despesa'])}</td></tr>" for _, row in monthly_summary.iterrows())
+            sections.append(f"<h2>Histórico Mensal (12 meses)</h2><table><tr><th>Mês</th><th>Receitas</th><th>Despesas</th></tr>{history}</table>")
+            fig_history = px.line(monthly_summary, x='month_year', y=['Receita', 'Despesa'], markers=True,
+                                  labels={'month_year': 'Mês/Ano', 'value': 'Valor (R$)', 'variable': 'Tipo'},
+                                  color_discrete_map={"Receita": "blue", "Despesa": "red"})
+            sections.append(_figure(fig_history, with_charts))
+
+    sections.append("<h2>Transações do Mês</h2>" + _table(df_period, TRANSACTION_TABLE_COLUMNS))
+
+    if df_moto is not None and not df_moto.empty:
+        stats = finance_data.moto_stats(df_moto)
+        moto_period = df_moto[df_moto['date'].dt.strftime('%Y-%m') == month_year]
+        consumption = []
+        if stats['cost_per_km'] > 0: consumption.append(f"Custo médio de combustível: {format_currency_manual(stats['cost_per_km'])} / KM")
+        if stats['km_per_liter'] > 0: consumption.append(f"Consumo médio: {stats['km_per_liter']:.2f} KM / L")
+        sections.append(f"<h2>Moto</h2><p>Custo total com a moto: {format_currency_manual(stats['total_cost'])}</p>"
+                        + "".join(f"<p>{line}</p>" for line in consumption)
+                        + f"<h3>Despesas de {month_label}</h3>" + _table(moto_period, MOTO_TABLE_COLUMNS))
+
+    return (f"<!DOCTYPE html><html lang='pt-BR'><head><meta charset='utf-8'><title>{html.escape(subject)} — {month_label}</title>"
+            f"<style>{PAGE_STYLE}</style></head><body>{''.join(sections)}</body></html>")
+
+def _file_name(subject, month_year, output_format):
+    slug = re.sub(r"\W+", "_", normalize_text(subject)).strip("_")
+    return f"{month_year}_{slug}.{output_format}"
+
+def write_report(task):
+    subject, month_year, df_history, df_moto, output_format, output_dir = task
+    document = render_report_html(subject, month_year, df_history, df_moto, with_charts=output_format == "html")
+    path = os.path.join(output_dir, _file_name(subject, month_year, output_format))
+    if output_format == "pdf": WeasyHTML(string=document).write_pdf(path)
+    else:
+        with open(path, "w", encoding="utf-8") as report_file: report_file.write(document)
+    return path
+
+
+# --- Execução ---
+def build_tasks(df_transactions, df_moto, months, subjects, output_format, output_dir):
+    # Cada processo recebe só o histórico do seu usuário (ou do casal), não a base inteira
+    tasks = []
+    for subject in subjects:
+        if subject == COUPLE_SUBJECT: df_history, df_subject_moto = df_transactions, df_moto
+        else: df_history, df_subject_moto = df_transactions[df_transactions['user'] == subject], None
+        for month_year in months:
+            tasks.append((subject, month_year, df_history, df_subject_moto, output_format, output_dir))
+    return tasks
+
+def generate_reports(tasks, workers=None):
+    if workers == 1: return [write_report(task) for task in tasks]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(write_report, tasks))
+
+def _month_arg(value):
+    try: datetime.datetime.strptime(value, "%Y-%m")
+    except ValueError: raise argparse.ArgumentTypeError(f"Mês inválido: {value} (use AAAA-MM)")
+    return value
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Gera os relatórios mensais por usuário e do casal, sem o Streamlit.")
+    parser.add_argument("--month", action="append", type=_month_arg, dest="months", help="Mês no formato AAAA-MM (pode repetir; padrão: mês corrente)")
+    parser.add_argument("--user", action="append", dest="users", help=f"Usuário (pode repetir; padrão: todos os usuários e '{COUPLE_SUBJECT}')")
+    parser.add_argument("--format", choices=("html", "pdf"), default="html", dest="output_format")
+    parser.add_argument("--output-dir", default="relatorios")
+    parser.add_argument("--workers", type=int, default=None, help="Processos em paralelo (padrão: número de CPUs)")
+    parser.add_argument("--credentials", help="Arquivo JSON da conta de serviço (padrão: variável FIREBASE_SERVICE_ACCOUNT_JSON)")
+    args = parser.parse_args(argv)
+
+    if args.output_format == "pdf" and WeasyHTML is None:
+        parser.error("--format pdf requer o pacote weasyprint (pip install weasyprint).")
+    months = args.months or [datetime.date.today().strftime("%Y-%m")]
+
+    db = connect_firestore(args.credentials)
+    df_transactions, df_moto = load_frames(FinanceRepository(db, FirestoreGateway(db, daily_read_budget=None)))
+    subjects = args.users or sorted(df_transactions['user'].dropna().unique()) + [COUPLE_SUBJECT]
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    started = datetime.datetime.now()
+    paths = generate_reports(build_tasks(df_transactions, df_moto, months, subjects, args.output_format, args.output_dir), args.workers)
+    for path in paths: print(path)
+    print(f"{len(paths)} relatório(s) gerado(s) em {(datetime.datetime.now() - started).total_seconds():.1f}s", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
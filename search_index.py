@@ -0,0 +1,154 @@
+"""Índice invertido em memória para a busca textual nos lançamentos.
+
+Os termos são normalizados sem acentos e em minúsculas; cada termo da consulta
+casa por prefixo ("pne" encontra "Pneu traseiro"). O índice é mantido por
+documento: as escritas do app o atualizam na hora, e só uma leitura nova do
+banco (outro fetched_at) é comparada lançamento a lançamento.
+"""
+import bisect
+import datetime
+import re
+import threading
+import unicodedata
+
+_TOKEN_RE = re.compile(r"\w+")
+
+
+def normalize_text(text):
+    decomposed = unicodedata.normalize("NFKD", str(text))
+    return "".join(ch for ch in decomposed if not unicodedata.combining(ch)).casefold()
+
+
+def tokenize(text):
+    return _TOKEN_RE.findall(normalize_text(text))
+
+
+def _as_date(value):
+    if isinstance(value, datetime.datetime): return value.date()
+    if isinstance(value, datetime.date): return value
+    return None
+
+
+class SearchIndex:
+    def __init__(self, fields):
+        self.fields = tuple(fields)
+        self._lock = threading.RLock()
+        self._postings = {}     # termo -> {(coleção, id)}
+        self._vocabulary = []   # termos ordenados, para a busca por prefixo
+        self._doc_tokens = {}   # (coleção, id) -> termos do documento
+        self._doc_text = {}     # (coleção, id) -> valores dos campos indexados
+        self._doc_meta = {}     # (coleção, id) -> (valor, data)
+        self._staged = {}       # coleção -> (fetched_at, linhas, escritas posteriores) ainda não aplicados ao índice
+        self._synced_at = {}    # coleção -> fetched_at da leitura já aplicada
+
+    def __len__(self):
+        return len(self._doc_tokens)
+
+    # --- Manutenção ---
+    def _add_token(self, token, doc_key):
+        postings = self._postings.get(token)
+        if postings is None:
+            postings = self._postings[token] = set()
+            bisect.insort(self._vocabulary, token)
+        postings.add(doc_key)
+
+    def _remove_token(self, token, doc_key):
+        postings = self._postings.get(token)
+        if postings is None: return
+        postings.discard(doc_key)
+        if not postings:
+            del self._postings[token]
+            del self._vocabulary[bisect.bisect_left(self._vocabulary, token)]
+
+    def upsert(self, collection, doc_id, data):
+        doc_key = (collection, doc_id)
+        text = tuple(data.get(field) or "" for field in self.fields)
+        amount = data.get("amount")
+        with self._lock:
+            self._doc_meta[doc_key] = (float(amount) if amount is not None else None, _as_date(data.get("date")))
+            if self._doc_text.get(doc_key) == text: return
+            old_tokens = self._doc_tokens.get(doc_key, frozenset())
+            new_tokens = frozenset(token for value in text for token in tokenize(value))
+            for token in old_tokens - new_tokens: self._remove_token(token, doc_key)
+            for token in new_tokens - old_tokens: self._add_token(token, doc_key)
+            self._doc_tokens[doc_key] = new_tokens
+            self._doc_text[doc_key] = text
+
+    def remove(self, collection, doc_id):
+        doc_key = (collection, doc_id)
+        with self._lock:
+            for token in self._doc_tokens.pop(doc_key, ()): self._remove_token(token, doc_key)
+            self._doc_text.pop(doc_key, None)
+            self._doc_meta.pop(doc_key, None)
+
+    def sync(self, collection, rows):
+        # rows: [(doc_id, dict)] com o estado atual completo da coleção
+        with self._lock:
+            current_ids = set()
+            for doc_id, data in rows:
+                current_ids.add(doc_id)
+                self.upsert(collection, doc_id, data)
+            removed = [doc_id for coll, doc_id in self._doc_tokens if coll == collection and doc_id not in current_ids]
+            for doc_id in removed: self.remove(collection, doc_id)
+
+    def stage(self, collection, rows, fetched_at):
+        # Guarda a leitura mais recente; a diferença só é aplicada quando alguém busca.
+        # Reaproveitar a mesma leitura não exige nada: as escritas do app chegam por apply_write
+        with self._lock:
+            staged = self._staged.get(collection)
+            if fetched_at == self._synced_at.get(collection) or (staged and staged[0] == fetched_at): return
+            self._staged[collection] = (fetched_at, rows, {})
+
+    def sync_staged(self):
+        with self._lock:
+            staged, self._staged = self._staged, {}
+            for collection, (fetched_at, rows, writes) in staged.items():
+                self.sync(collection, rows)
+                for doc_id, data in writes.items(): self._apply(collection, doc_id, data)
+                self._synced_at[collection] = fetched_at
+
+    def _apply(self, collection, doc_id, data):
+        if data is None: self.remove(collection, doc_id)
+        else: self.upsert(collection, doc_id, data)
+
+    def apply_write(self, collection, doc_id, data=None):
+        # Chamado a cada escrita do app, com o documento completo (None: exclusão)
+        with self._lock:
+            # Uma leitura guardada e ainda não aplicada é anterior à escrita: ela é reaplicada por cima
+            if collection in self._staged: self._staged[collection][2][doc_id] = data
+            self._apply(collection, doc_id, data)
+
+    def invalidate(self, collection):
+        # A próxima leitura da coleção volta a ser comparada por inteiro (ex.: uma escrita otimista falhou)
+        with self._lock:
+            self._staged.pop(collection, None)
+            self._synced_at.pop(collection, None)
+
+    # --- Consulta ---
+    def _prefix_postings(self, term):
+        start = bisect.bisect_left(self._vocabulary, term)
+        end = bisect.bisect_left(self._vocabulary, term + "\uffff")
+        matches = set()
+        for token in self._vocabulary[start:end]: matches |= self._postings[token]
+        return matches
+
+    def search(self, query, collections=None, min_amount=None, max_amount=None, start_date=None, end_date=None):
+        terms = tokenize(query)
+        with self._lock:
+            self.sync_staged()
+            if terms:
+                candidate_sets = sorted((self._prefix_postings(term) for term in terms), key=len)
+                doc_keys = set.intersection(*candidate_sets)
+            else:
+                doc_keys = set(self._doc_tokens)
+            results = []
+            for doc_key in doc_keys:
+                if collections is not None and doc_key[0] not in collections: continue
+                amount, date = self._doc_meta[doc_key]
+                if min_amount is not None and (amount is None or amount < min_amount): continue
+                if max_amount is not None and (amount is None or amount > max_amount): continue
+                if start_date is not None and (date is None or date < start_date): continue
+                if end_date is not None and (date is None or date > end_date): continue
+                results.append((date or datetime.date.min, doc_key))
+        results.sort(reverse=True)  # Mais recentes primeiro
+        return [doc_key for _, doc_key in results]
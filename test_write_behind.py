@@ -0,0 +1,115 @@
+"""Testes da fila de escrita adiada (write_behind.py) contra o Firestore em memória do loadtest.
+
+Uso:
+    python -m pytest -q test_write_behind.py
+"""
+from google.api_core import exceptions as google_exceptions
+
+from firestore_access import FirestoreGateway
+from loadtest import InMemoryFirestore
+from write_behind import WriteBehindQueue
+
+
+class ManualQueue(WriteBehindQueue):
+    # Sem a thread de envio: os testes chamam flush() quando querem
+    def _run(self):
+        pass
+
+
+class SimulatedCrash(BaseException):
+    # Interrompe o envio como uma queda do processo: a alteração fica marcada como "em envio" no SQLite
+    pass
+
+
+def make_queue(db, path, write_guard=None):
+    return ManualQueue(db, FirestoreGateway(db, daily_read_budget=None, max_attempts=1), path=str(path), write_guard=write_guard)
+
+
+def make_db(**data):
+    db = InMemoryFirestore()
+    db.collections["transactions"]["t1"] = {"user": "Luiz", "amount": 5.0, "status_pagamento": "Pago", **data}
+    return db
+
+
+def stored(db):
+    return db.collections["transactions"].get("t1")
+
+
+def total_writes(db):
+    return sum(db.writes.values())
+
+
+def test_status_back_to_original_is_never_sent(tmp_path):
+    db = make_db()
+    queue = make_queue(db, tmp_path / "queue.sqlite3")
+    queue.enqueue_update("transactions", "t1", {"status_pagamento": "Pendente"}, {"status_pagamento": "Pago"}, "Luiz")
+    queue.enqueue_update("transactions", "t1", {"status_pagamento": "Pago"}, {"status_pagamento": "Pendente"}, "Luiz")
+    assert queue.pending_count() == 0
+    queue.flush()
+    assert total_writes(db) == 0
+    assert make_queue(db, tmp_path / "queue.sqlite3").pending_count() == 0
+
+
+def test_delete_wins_over_later_update(tmp_path):
+    db = make_db()
+    queue = make_queue(db, tmp_path / "queue.sqlite3")
+    queue.enqueue_delete("transactions", "t1", "Luiz")
+    queue.enqueue_update("transactions", "t1", {"amount": 7.0}, {"amount": 5.0}, "Luiz")
+    entry = queue._pending[("transactions", "t1")]
+    assert (entry.op, entry.fields) == ("delete", {})
+    assert queue.apply_pending("transactions", [("t1", dict(stored(db)))]) == []
+    queue.flush()
+    assert stored(db) is None
+    assert queue.pending_count() == 0
+
+
+def test_requeue_merges_newer_pending_edit(tmp_path):
+    db = make_db()
+    calls = []
+
+    def flaky_guard(entry, write):
+        calls.append(dict(entry.fields))
+        if len(calls) == 1:
+            # Uma edição nova chega enquanto o primeiro envio está em andamento, que então falha
+            queue.enqueue_update("transactions", "t1", {"status_pagamento": "Pendente"}, {"status_pagamento": "Pago"}, "Luiz")
+            raise google_exceptions.ServiceUnavailable("indisponível")
+        write()
+
+    queue = make_queue(db, tmp_path / "queue.sqlite3", write_guard=flaky_guard)
+    queue.enqueue_update("transactions", "t1", {"amount": 7.0}, {"amount": 5.0}, "Luiz")
+    queue.flush()
+    assert stored(db)["amount"] == 5.0
+    assert queue.pending_count() == 1  # As duas edições viraram uma só
+    entry = queue._pending[("transactions", "t1")]
+    assert entry.fields == {"amount": 7.0, "status_pagamento": "Pendente"}
+    assert entry.attempts == 1
+    entry.next_attempt_at = 0.0  # Dispensa a espera do backoff
+    queue.flush()
+    assert calls[-1] == {"amount": 7.0, "status_pagamento": "Pendente"}
+    assert stored(db)["amount"] == 7.0 and stored(db)["status_pagamento"] == "Pendente"
+    assert queue.pending_count() == 0
+
+
+def test_in_flight_write_survives_restart_with_newer_edit_on_top(tmp_path):
+    db = make_db()
+    path = tmp_path / "queue.sqlite3"
+
+    def crashing_guard(entry, write):
+        raise SimulatedCrash()
+
+    queue = make_queue(db, path, write_guard=crashing_guard)
+    queue.enqueue_update("transactions", "t1", {"amount": 7.0, "category": "Mercado"}, {"amount": 5.0}, "Luiz")
+    try:
+        queue.flush()
+    except SimulatedCrash:
+        pass
+    assert ("transactions", "t1") in queue._in_flight
+    queue.enqueue_update("transactions", "t1", {"amount": 9.0, "status_pagamento": "Pendente"},
+                         {"amount": 7.0, "status_pagamento": "Pago"}, "Luiz")
+
+    restored = make_queue(db, path)
+    assert restored.pending_count() == 1
+    restored.flush()
+    data = stored(db)
+    assert (data["amount"], data["category"], data["status_pagamento"]) == (9.0, "Mercado", "Pendente")
+    assert make_queue(db, path).pending_count() == 0
@@ -0,0 +1,263 @@
+"""Fila de escrita adiada (write-behind) para o modo otimista.
+
+As alterações entram na fila e já aparecem nos dados exibidos; uma thread em
+segundo plano as envia ao Firestore. A fila fica num arquivo SQLite local para
+sobreviver a reinícios do processo. Alterações pendentes no mesmo documento são
+combinadas, e as que voltam ao valor original (ex.: Pago → Pendente → Pago) são
+descartadas sem chegar ao banco.
+"""
+import datetime
+import json
+import sqlite3
+import threading
+import time
+
+from firebase_admin import firestore
+
+from firestore_access import TRANSIENT_ERRORS
+
+DEFAULT_QUEUE_PATH = ".write_behind_queue.sqlite3"
+MAX_FLUSH_ATTEMPTS = 8
+MAX_RETRY_DELAY = 60.0
+_MISSING = "__campo_inexistente__"
+
+
+def _plain(value):
+    # Normaliza valores vindos do pandas para comparação e serialização
+    if hasattr(value, "item"): value = value.item()  # Escalares numpy
+    if isinstance(value, datetime.date) and not isinstance(value, datetime.datetime):
+        value = datetime.datetime.combine(value, datetime.datetime.min.time())
+    try:
+        if value != value: return None  # NaN
+    except TypeError:
+        return None  # pd.NA
+    return value
+
+
+def _json_default(value):
+    if isinstance(value, datetime.datetime): return {"$datetime": value.isoformat()}
+    raise TypeError(f"Valor não serializável na fila: {value!r}")
+
+
+def _json_object_hook(obj):
+    if set(obj) == {"$datetime"}: return datetime.datetime.fromisoformat(obj["$datetime"])
+    return obj
+
+
+def _same(a, b):
+    a, b = _plain(a), _plain(b)
+    if isinstance(a, datetime.datetime) and isinstance(b, datetime.datetime):
+        return a.replace(tzinfo=None) == b.replace(tzinfo=None)
+    return a == b
+
+
+class PendingWrite:
+    def __init__(self, collection, doc_id, user, op="update", fields=None, base=None, label="", attempts=0):
+        self.collection = collection
+        self.doc_id = doc_id
+        self.user = user
+        self.op = op
+        self.fields = fields or {}
+        self.base = base or {}  # Valor de cada campo antes da primeira alteração pendente
+        self.label = label
+        self.attempts = attempts
+        self.next_attempt_at = 0.0
+
+    @property
+    def key(self):
+        return (self.collection, self.doc_id)
+
+    def is_noop(self):
+        return self.op == "update" and not self.fields
+
+    def merge_update(self, fields, base):
+        if self.op == "delete": return  # A exclusão prevalece sobre edições posteriores
+        for field, value in fields.items():
+            value = _plain(value)
+            if field not in self.base:
+                self.base[field] = _plain(base.get(field, _MISSING))
+            self.fields[field] = value
+            if _same(value, self.base[field]):
+                del self.fields[field]; del self.base[field]
+
+    def merge(self, newer):
+        if newer.op == "delete":
+            self.op, self.fields, self.base = "delete", {}, {}
+        else:
+            self.merge_update(newer.fields, newer.base)
+        self.label = newer.label or self.label
+
+
+class WriteBehindQueue:
+    def __init__(self, db, gateway, path=DEFAULT_QUEUE_PATH, flush_interval=0.5, on_failure=None, write_guard=None):
+        self.db = db
+        self.gateway = gateway
+        self.flush_interval = flush_interval
+        self.on_failure = on_failure  # Chamado com a alteração descartada, para desfazer efeitos colaterais
+        self.write_guard = write_guard  # write_guard(entry, write): envolve o envio (ex.: desarquivar o mês antes)
+        self._lock = threading.RLock()
+        self._pending = {}
+        self._in_flight = {}
+        self._failures = []
+        self._wake = threading.Event()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS pending_writes (collection TEXT, doc_id TEXT, in_flight INTEGER, op TEXT,"
+            " fields TEXT, base TEXT, user TEXT, label TEXT, attempts INTEGER, PRIMARY KEY (collection, doc_id, in_flight))"
+        )
+        self._restore()
+        self._worker = threading.Thread(target=self._run, name="write-behind", daemon=True)
+        self._worker.start()
+
+    # --- Persistência ---
+    def _restore(self):
+        # Envios interrompidos voltam para a fila, com as alterações mais novas por cima
+        rows = self._conn.execute(
+            "SELECT collection, doc_id, op, fields, base, user, label, attempts FROM pending_writes ORDER BY in_flight DESC"
+        ).fetchall()
+        for collection, doc_id, op, fields, base, user, label, attempts in rows:
+            entry = PendingWrite(collection, doc_id, user, op, json.loads(fields, object_hook=_json_object_hook),
+                                 json.loads(base, object_hook=_json_object_hook), label, attempts)
+            if entry.key in self._pending: self._pending[entry.key].merge(entry)
+            else: self._pending[entry.key] = entry
+        with self._conn:
+            self._conn.execute("DELETE FROM pending_writes")
+            for entry in self._pending.values(): self._save(entry, in_flight=False)
+
+    def _save(self, entry, in_flight):
+        with self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO pending_writes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (entry.collection, entry.doc_id, int(in_flight), entry.op, json.dumps(entry.fields, default=_json_default),
+                 json.dumps(entry.base, default=_json_default), entry.user, entry.label, entry.attempts)
+            )
+
+    def _forget(self, key, in_flight):
+        with self._conn:
+            self._conn.execute("DELETE FROM pending_writes WHERE collection = ? AND doc_id = ? AND in_flight = ?", (*key, int(in_flight)))
+
+    # --- Enfileiramento ---
+    def _enqueue(self, entry):
+        with self._lock:
+            current = self._pending.get(entry.key)
+            if current is not None:
+                current.merge(entry)
+                entry = current
+            if entry.is_noop():
+                self._pending.pop(entry.key, None)
+                self._forget(entry.key, in_flight=False)
+            else:
+                self._pending[entry.key] = entry
+                self._save(entry, in_flight=False)
+        self._wake.set()
+
+    def enqueue_update(self, collection, doc_id, fields, base, user, label=""):
+        entry = PendingWrite(collection, doc_id, user, label=label)
+        entry.merge_update(fields, base)
+        self._enqueue(entry)
+
+    def enqueue_delete(self, collection, doc_id, user, label=""):
+        self._enqueue(PendingWrite(collection, doc_id, user, op="delete", label=label))
+
+    # --- Leitura ---
+    def apply_pending(self, collection, rows):
+        with self._lock:
+            entries = [e for e in list(self._in_flight.values()) + list(self._pending.values()) if e.collection == collection]
+            if not entries: return rows
+            by_doc = {}
+            for entry in entries:
+                by_doc.setdefault(entry.doc_id, []).append((entry.op, dict(entry.fields)))
+        result = []
+        for doc_id, data in rows:
+            changes = by_doc.get(doc_id)
+            if changes:
+                if any(op == "delete" for op, _ in changes): continue
+                for _, fields in changes: data.update(fields)
+            result.append((doc_id, data))
+        return result
+
+    def pending_count(self, user=None):
+        with self._lock:
+            entries = list(self._pending.values()) + list(self._in_flight.values())
+        return sum(1 for e in entries if user is None or e.user == user)
+
+    def pop_failures(self, user):
+        with self._lock:
+            mine = [message for failure_user, message in self._failures if failure_user == user]
+            self._failures = [(u, m) for u, m in self._failures if u != user]
+        return mine
+
+    # --- Envio em segundo plano ---
+    def _run(self):
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Erro inesperado na fila de escrita: {e}")
+
+    def _write(self, entry):
+        doc_ref = self.db.collection(entry.collection).document(entry.doc_id)
+        if entry.op == "delete":
+            write = doc_ref.delete
+        else:
+            write = lambda: doc_ref.update({**entry.fields, "updated_at": firestore.SERVER_TIMESTAMP})
+        if self.write_guard: self.write_guard(entry, write)
+        else: write()
+
+    def flush(self):
+        now = time.monotonic()
+        with self._lock:
+            batch = [e for key, e in self._pending.items() if e.next_attempt_at <= now and key not in self._in_flight]
+            for entry in batch:
+                # Sai da fila de pendentes: novas alterações no documento partem do valor em envio
+                del self._pending[entry.key]
+                self._in_flight[entry.key] = entry
+                self._save(entry, in_flight=True)
+                self._forget(entry.key, in_flight=False)
+        for entry in batch:
+            try:
+                self.gateway.run_write(lambda entry=entry: self._write(entry))
+            except TRANSIENT_ERRORS as e:
+                self._requeue(entry, e)
+            except Exception as e:
+                self._fail(entry, e)
+            else:
+                # Antes de sair da sobreposição, a alteração entra nas respostas em cache do gateway: um rerun que as
+                # reaproveite não pode mostrar o valor antigo
+                self.gateway.record_write(entry.collection, entry.doc_id, None if entry.op == "delete" else entry.fields)
+                with self._lock:
+                    del self._in_flight[entry.key]
+                    self._forget(entry.key, in_flight=True)
+
+    def _requeue(self, entry, error):
+        with self._lock:
+            del self._in_flight[entry.key]
+            self._forget(entry.key, in_flight=True)
+            entry.attempts += 1
+            if entry.attempts >= MAX_FLUSH_ATTEMPTS:
+                self._record_failure(entry, error)
+                return
+            newer = self._pending.get(entry.key)
+            if newer is not None: entry.merge(newer)
+            entry.next_attempt_at = time.monotonic() + min(MAX_RETRY_DELAY, 2 ** entry.attempts)
+            if entry.is_noop():
+                self._pending.pop(entry.key, None)
+                self._forget(entry.key, in_flight=False)
+            else:
+                self._pending[entry.key] = entry
+                self._save(entry, in_flight=False)
+
+    def _fail(self, entry, error):
+        with self._lock:
+            del self._in_flight[entry.key]
+            self._forget(entry.key, in_flight=True)
+            self._record_failure(entry, error)
+
+    def _record_failure(self, entry, error):
+        # A alteração é descartada: a próxima leitura volta a mostrar o que está no banco
+        action = "excluir" if entry.op == "delete" else "salvar a alteração em"
+        label = f"'{entry.label}'" if entry.label else "um lançamento"
+        self._failures.append((entry.user, f"Não foi possível {action} {label}: {error}"))
+        if self.on_failure: self.on_failure(entry)